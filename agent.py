@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from prometheus_client import start_http_server, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+import receiver
+import sender
+
+# Configuration comes from the same environment variables as sender.py and
+# receiver.py; the agent only adds its own name.
+BEACON_NAME = sender.BEACON_NAME
+
+# Per-destination sender reports exported by SenderCollector: key -> (metric, help)
+SENDER_METRICS = {
+    'sent':                   ("rtp_sender_packets_sent", "RTP packets sent in the last test"),
+    'deadline_error_mean_ms': ("rtp_sender_deadline_error_mean_ms", "Mean lateness of sends against their deadline (ms)"),
+    'deadline_error_max_ms':  ("rtp_sender_deadline_error_max_ms", "Maximum lateness of sends against their deadline (ms)"),
+    'send_errors':            ("rtp_sender_send_errors", "RTP sends that failed in the last test (full send buffer, unreachable peer)"),
+    'rtt_mean_ms':            ("rtp_rtt_ms", "Mean round-trip time of reflected probes (ms)"),
+    'rtt_max_ms':             ("rtp_rtt_max_ms", "Maximum round-trip time of reflected probes (ms)"),
+}
+
+class SenderCollector:
+    """Exports the report of the last finished stream to each destination and profile."""
+
+    def __init__(self):
+        self.reports = {}
+        self.lock = threading.Lock()
+
+    def update(self, stream):
+        with self.lock:
+            self.reports[(stream.name, stream.profile)] = stream.report()
+
+    def collect(self):
+        with self.lock:
+            reports = list(self.reports.values())
+        for key, (name, doc) in SENDER_METRICS.items():
+            family = GaugeMetricFamily(name, doc, labels=['destination', 'profile'])
+            for r in reports:
+                if r[key] is not None:
+                    family.add_metric([r['name'], r['profile']], r[key])
+            yield family
+
+class Agent:
+    """
+    Sender and receiver of one beacon sharing a single asyncio loop and a
+    single UDP socket bound to receiver.PORT.
+
+    Incoming datagrams are split by their probe block: echoes of our own
+    probes go to the running test's RTT stats, everything else is ingested
+    as RTP from a peer. Streams are paced by sender.DeadlineScheduler with
+    the loop's sleep in place of a blocking one.
+    """
+
+    def __init__(self, sock, registry, name=BEACON_NAME):
+        self.sock = sock
+        self.registry = registry
+        self.name = name
+        self.rx = receiver.BatchReceiver(sock)
+        self.store = receiver.PacketStore()
+        self.streams = {}
+        self.sender_collector = SenderCollector()
+        self.health = receiver.IngestHealth()
+
+    def on_readable(self):
+        """Drain the socket; called by the loop whenever it is readable."""
+        while True:
+            n = self.rx.receive(0)
+            if not n:
+                return
+            started = time.perf_counter()
+            now = time.time()
+            now_ns = time.time_ns()
+            stamps = self.rx.stamps
+            for i in range(n):
+                packet = self.rx.packet(i)
+                if sender.record_echo(self.streams, packet, now_ns):
+                    continue
+                receiver.ingest_packet(self.store, packet, self.rx.addrs[i], stamps[i] or now)
+                if receiver.REFLECT:
+                    receiver.reflect_probe(self.sock, packet, self.rx.addrs[i])
+            self.health.record_batch(n, time.perf_counter() - started, self.rx.drops)
+            if n < self.rx.batch:
+                return
+
+    async def close_windows(self):
+        window_end = receiver.first_window_check(time.time())
+        while True:
+            await asyncio.sleep(max(window_end - time.time(), 0))
+            now = time.time()
+            self.health.record_check(now - window_end, self.sock)
+            started = time.perf_counter()
+            stamp, results, window_end = receiver.close_due(self.store, now, window_end)
+            if results is not None:
+                self.health.record_window(time.perf_counter() - started)
+                receiver.publish_window(stamp, results)
+
+    async def send_cycles(self):
+        """One test every CYCLE_SECONDS, as in sender.py --service."""
+        while True:
+            start_time = sender.next_cycle_start(datetime.now(timezone.utc))
+            print(f"[AGENT] Next test at {start_time.isoformat()} to {len(self.registry.targets())} destinations")
+            await asyncio.sleep((start_time - datetime.now(timezone.utc)).total_seconds())
+            targets = self.registry.targets()
+            if targets:
+                await self.send(targets)
+            else:
+                print("[AGENT] No valid destinations after filtering self.")
+
+    async def send(self, targets):
+        scheduler, streams, start = sender.start_streams(self.sock, targets, self.name)
+        self.streams = streams
+        while scheduler.next_deadline() is not None:
+            delay = scheduler.next_deadline() - scheduler.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            for stream in scheduler.run_due(scheduler.clock()):
+                sender.log_stream_report(stream)
+                self.sender_collector.update(stream)
+            sender.apply_destination_changes(self.registry, scheduler, self.sock, streams, start + sender.DURATION)
+        if any(s.echoes for s in streams.values()):
+            await asyncio.sleep(sender.ECHO_GRACE)
+            for stream in streams.values():
+                sender.log_rtt_report(stream)
+                self.sender_collector.update(stream)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.sock, self.on_readable)
+        try:
+            await asyncio.gather(self.close_windows(), self.send_cycles())
+        finally:
+            loop.remove_reader(self.sock)
+
+def run_agent():
+    """
+    Run a whole beacon in one process: one config, one UDP socket for
+    sending and receiving, and one metrics endpoint for both sides.
+    """
+    own_ip = sender.get_own_ip()
+    print(f"[AGENT] Starting {BEACON_NAME} ({own_ip})")
+    registry = sender.DestinationRegistry(own_ip=own_ip)
+    try:
+        registry.load()
+    except RuntimeError as e:
+        print(f"[AGENT] {e} Retrying every {sender.REFRESH_INTERVAL:g} seconds.")
+    registry.watch()
+
+    sock = receiver.open_rtp_socket()
+    agent = Agent(sock, registry)
+    REGISTRY.register(agent.sender_collector)
+    receiver.health_collector.add(0, agent.health)
+    start_http_server(receiver.METRICS_PORT)
+    print(f"[AGENT] Prometheus metrics exposed at :{receiver.METRICS_PORT}/metrics")
+    receiver.start_history()
+    receiver.start_source_names()
+    print(f"[AGENT] Sending and listening on UDP {receiver.PORT}, {receiver.WINDOW_SECONDS:g} s windows")
+    try:
+        asyncio.run(agent.run())
+    finally:
+        sock.close()
+
+if __name__ == "__main__":
+    run_agent()
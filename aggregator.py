@@ -0,0 +1,174 @@
+"""
+Central mesh aggregator: receivers push a compact binary summary of every
+window (see receiver.encode_summaries) and the aggregator keeps the latest
+source x destination matrix in memory, so the whole mesh is one scrape.
+
+    AGGREGATOR_URL=udp://aggregator:9101 python3 receiver.py     # on each beacon
+    python3 aggregator.py                                         # anywhere, even locally
+
+Endpoints on AGGREGATOR_HTTP_PORT:
+    GET  /metrics      every cell as rtp_mesh_* gauges labelled source/destination/profile
+    GET  /matrix       the matrices as JSON, one per stream profile, rows are
+                       sources and columns destinations
+    POST /summary      summary messages, the same bytes as the UDP datagrams
+"""
+import argparse
+import json
+import math
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+import receiver
+
+# Configuration (each value can be overridden through the environment)
+AGGREGATOR_HTTP_PORT = int(os.environ.get("AGGREGATOR_HTTP_PORT", 9100))
+AGGREGATOR_UDP_PORT = int(os.environ.get("AGGREGATOR_UDP_PORT", 9101))
+MATRIX_TTL = float(os.environ.get("MATRIX_TTL", receiver.SERIES_TTL_WINDOWS * receiver.WINDOW_SECONDS))  # seconds a cell outlives its last window
+
+# Matrix cell fields exported by MatrixCollector: key -> (metric, help)
+CELL_METRICS = {
+    'loss_pct':      ("rtp_mesh_packet_loss_percent", "RTP packet loss (%) from source to destination"),
+    'jitter_ms':     ("rtp_mesh_jitter_ms", "RTP interarrival jitter, RFC 3550 (ms)"),
+    'jitter_p50_ms': ("rtp_mesh_jitter_p50_ms", "Median RTP transit variation (ms)"),
+    'jitter_p99_ms': ("rtp_mesh_jitter_p99_ms", "99th percentile RTP transit variation (ms)"),
+    'delay_ms':      ("rtp_mesh_one_way_delay_ms", "Mean one-way delay (ms)"),
+    'delay_p99_ms':  ("rtp_mesh_one_way_delay_p99_ms", "99th percentile one-way delay (ms)"),
+    'mos':           ("rtp_mesh_mos_score", "Mean Opinion Score"),
+    'received':      ("rtp_mesh_packets_received", "RTP packets received in the last window"),
+    'lost':          ("rtp_mesh_packets_lost", "RTP packets lost in the last window"),
+}
+
+class MeshMatrix:
+    """Latest window per (source, destination, profile), expiring after MATRIX_TTL."""
+
+    def __init__(self, ttl=MATRIX_TTL):
+        self.ttl = ttl
+        self.cells = {}
+        self.lock = threading.Lock()
+
+    def ingest(self, data):
+        """Apply summary messages; returns the number of cells updated."""
+        updated = 0
+        for destination, window_end, record in receiver.decode_summaries(data):
+            sketch = record.pop('jitter_sketch')
+            record['jitter_p50_ms'] = sketch.quantile(0.5)
+            record['jitter_p99_ms'] = sketch.quantile(0.99)
+            record['window_end'] = window_end
+            key = (record['source'], destination, record['profile'])
+            with self.lock:
+                cell = self.cells.get(key)
+                if cell is None or cell['window_end'] <= window_end:
+                    self.cells[key] = record
+            updated += 1
+        return updated
+
+    def snapshot(self, now=None):
+        """Live cells as {(source, destination, profile): record}, dropping expired ones."""
+        now = time.time() if now is None else now
+        with self.lock:
+            for key in [k for k, c in self.cells.items() if now - c['window_end'] >= self.ttl]:
+                del self.cells[key]
+            return dict(self.cells)
+
+    def to_json(self):
+        cells = self.snapshot()
+        nodes = sorted({name for source, destination, _ in cells for name in (source, destination)})
+        index = {name: i for i, name in enumerate(nodes)}
+        fields = list(CELL_METRICS) + ['window_end']
+        profiles = {}
+        for (source, destination, profile), cell in cells.items():
+            matrix = profiles.get(profile)
+            if matrix is None:
+                matrix = profiles[profile] = {f: [[None] * len(nodes) for _ in nodes] for f in fields}
+            for f in fields:
+                value = cell[f]
+                matrix[f][index[source]][index[destination]] = None if math.isnan(value) else value
+        return {'nodes': nodes, 'rows': 'source', 'columns': 'destination', 'profiles': profiles}
+
+class MatrixCollector:
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def collect(self):
+        cells = self.matrix.snapshot()
+        for key, (metric, documentation) in CELL_METRICS.items():
+            family = GaugeMetricFamily(metric, documentation, labels=['source', 'destination', 'profile'])
+            for labels, cell in cells.items():
+                family.add_metric(list(labels), cell[key], timestamp=cell['window_end'])
+            yield family
+
+def make_handler(matrix, registry):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == '/metrics':
+                self.reply(200, CONTENT_TYPE_LATEST, generate_latest(registry))
+            elif path in ('/matrix', '/matrix.json'):
+                self.reply(200, 'application/json', json.dumps(matrix.to_json()).encode())
+            else:
+                self.reply(404, 'text/plain', b'Not found\n')
+
+        def do_POST(self):
+            if self.path.split('?')[0] != '/summary':
+                self.reply(404, 'text/plain', b'Not found\n')
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.reply(400, 'text/plain', b'Bad Content-Length\n')
+                return
+            body = self.rfile.read(length)
+            try:
+                matrix.ingest(body)
+            except ValueError as e:
+                self.reply(400, 'text/plain', f"{e}\n".encode())
+                return
+            self.reply(204, 'text/plain', b'')
+
+        def reply(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+def serve_udp(matrix, port):
+    """Ingest summary datagrams on port forever."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', port))
+    while True:
+        data, addr = sock.recvfrom(65535)
+        try:
+            matrix.ingest(data)
+        except ValueError as e:
+            print(f"[AGGREGATOR] Ignoring summary from {addr[0]}: {e}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SpiderMon mesh aggregator")
+    parser.add_argument("--http-port", type=int, default=AGGREGATOR_HTTP_PORT)
+    parser.add_argument("--udp-port", type=int, default=AGGREGATOR_UDP_PORT)
+    args = parser.parse_args(argv)
+
+    matrix = MeshMatrix()
+    registry = CollectorRegistry()
+    registry.register(MatrixCollector(matrix))
+    threading.Thread(target=serve_udp, args=(matrix, args.udp_port), daemon=True).start()
+    server = ThreadingHTTPServer(('', args.http_port), make_handler(matrix, registry))
+    print(f"[AGGREGATOR] Summaries on UDP {args.udp_port} and POST :{args.http_port}/summary")
+    print(f"[AGGREGATOR] Matrix at :{args.http_port}/metrics and :{args.http_port}/matrix")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
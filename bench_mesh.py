@@ -0,0 +1,205 @@
+"""
+Loopback mesh benchmark: N virtual senders streaming into one receiver,
+swept over N to find the largest mesh a beacon sustains.
+
+Each run paces N RtpStreams from one DeadlineScheduler, every stream from
+its own 127.x address so the receiver sees N sources, and ingests them
+with the receiver's ingest_loop in a separate process. Packets are dropped
+at the sending socket with a known probability, and RFC 3550 jitter is
+computed over the actual send times, giving ground truth to compare the
+receiver's windows against.
+
+    python3 bench_mesh.py [--sizes 1,10,50,100] [--duration 10] [--loss 1] [--output report.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import sys
+import time
+
+import receiver
+import sender
+
+class LossySocket:
+    """
+    Wraps a UDP socket, dropping sends at random and recording the rest.
+    Only drops between the first and last delivered packet count as lost,
+    as those are the only ones a receiver can see.
+    """
+
+    def __init__(self, sock, loss, rng):
+        self.sock = sock
+        self.loss = loss
+        self.rng = rng
+        self.delivered = 0
+        self.dropped = 0
+        self.pending = 0
+        self.jitter = receiver.JitterEstimator()
+
+    def sendto(self, pkt, addr):
+        if self.rng.random() < self.loss:
+            if self.delivered:
+                self.pending += 1
+            return
+        _, _, ts, _ = receiver.RTP_HEADER.unpack_from(pkt)
+        self.sock.sendto(pkt, addr)
+        self.jitter.update(time.time(), ts)
+        self.delivered += 1
+        self.dropped += self.pending
+        self.pending = 0
+
+    def loss_pct(self):
+        expected = self.delivered + self.dropped
+        return 100.0 * self.dropped / expected if expected else 0.0
+
+def source_address(i):
+    return f"127.1.{(i + 1) >> 8}.{(i + 1) & 255}"
+
+def kernel_drops(port):
+    """Datagrams the kernel dropped on the UDP socket bound to port, if known."""
+    try:
+        with open("/proc/net/udp") as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if int(fields[1].split(":")[1], 16) == port:
+                    return int(fields[-1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+def receiver_main(channel):
+    """Receiver under test: per-source windows so each source reports once."""
+    receiver.RECEIVER_WINDOWS = 'per-source'
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+    sock.bind(("127.0.0.1", 0))
+    channel.put(("ready", sock.getsockname()[1], time.process_time()))
+    receiver.ingest_loop(sock, lambda stamp, results: channel.put(("window", results, time.process_time())))
+
+def run_mesh(n, duration, loss, seed):
+    channel = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=receiver_main, args=(channel,), daemon=True)
+    proc.start()
+    socks, streams = [], []
+    try:
+        _, port, rx_cpu_start = channel.get(timeout=10)
+        rng = random.Random(seed)
+        scheduler = sender.DeadlineScheduler()
+        start = scheduler.clock() + 0.1
+        for i in range(n):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((source_address(i), 0))
+            target = {"name": source_address(i), "ip": "127.0.0.1", "port": port}
+            stream = sender.RtpStream(LossySocket(sock, loss / 100, rng), target, start, duration=duration)
+            socks.append(sock)
+            streams.append(stream)
+            scheduler.add(stream, start)
+        tx_cpu = time.process_time()
+        scheduler.run()
+        tx_cpu = time.process_time() - tx_cpu
+
+        results, rx_cpu = {}, rx_cpu_start
+        deadline = time.monotonic() + receiver.STREAM_TIMEOUT + 10
+        while len(results) < n and (remaining := deadline - time.monotonic()) > 0:
+            try:
+                _, window, rx_cpu = channel.get(timeout=remaining)
+            except queue.Empty:
+                break
+            for r in window:
+                results[r['source_ip']] = r
+        drops = kernel_drops(port)
+    finally:
+        proc.terminate()
+        for sock in socks:
+            sock.close()
+
+    errors = {"loss": [], "jitter": []}
+    true_loss, true_jitter = [], []
+    for stream in streams:
+        lossy = stream.sock
+        r = results.get(stream.name)
+        loss_pct = lossy.loss_pct()
+        true_loss.append(loss_pct)
+        true_jitter.append(lossy.jitter.jitter_ms())
+        if r is not None:
+            errors["loss"].append(abs(r['loss_pct'] - loss_pct))
+            errors["jitter"].append(abs(r['jitter_ms'] - lossy.jitter.jitter_ms()))
+    reports = [s.report() for s in streams]
+    stream_seconds = n * duration
+    return {
+        "n": n,
+        "sender": {
+            "packets": sum(s.sent for s in streams),
+            "deadline_error_mean_ms": sum(r["deadline_error_mean_ms"] for r in reports) / n,
+            "deadline_error_max_ms": max(r["deadline_error_max_ms"] for r in reports),
+            "cpu_percent_per_stream": 100 * tx_cpu / stream_seconds,
+        },
+        "receiver": {
+            "sources_reported": len(results),
+            "packets": sum(r['received'] for r in results.values()),
+            "kernel_drops": drops,
+            "cpu_percent_per_stream": 100 * (rx_cpu - rx_cpu_start) / stream_seconds,
+        },
+        "loss_pct": {
+            "true_mean": sum(true_loss) / n,
+            "measured_mean": sum(r['loss_pct'] for r in results.values()) / len(results) if results else None,
+            "abs_error_max": max(errors["loss"], default=None),
+        },
+        "jitter_ms": {
+            "true_mean": sum(true_jitter) / n,
+            "measured_mean": sum(r['jitter_ms'] for r in results.values()) / len(results) if results else None,
+            "abs_error_max": max(errors["jitter"], default=None),
+        },
+    }
+
+def sustainable(run, interval, loss_tolerance):
+    """A mesh size is sustained when pacing, ingest and accuracy all hold up."""
+    return (run["sender"]["deadline_error_max_ms"] < 1000 * interval
+            and run["receiver"]["sources_reported"] == run["n"]
+            and not run["receiver"]["kernel_drops"]
+            and run["loss_pct"]["abs_error_max"] is not None
+            and run["loss_pct"]["abs_error_max"] <= loss_tolerance)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SpiderMon loopback mesh benchmark")
+    parser.add_argument("--sizes", default="1,10,50,100,200", help="comma-separated mesh sizes to sweep")
+    parser.add_argument("--duration", type=float, default=10, help="seconds each run streams for")
+    parser.add_argument("--loss", type=float, default=1.0, help="percent of packets dropped at the sender")
+    parser.add_argument("--loss-tolerance", type=float, default=0.5, help="max loss error (percentage points) still sustainable")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for n in (int(s) for s in args.sizes.split(",")):
+        run = run_mesh(n, args.duration, args.loss, args.seed)
+        run["sustainable"] = sustainable(run, sender.INTERVAL, args.loss_tolerance)
+        runs.append(run)
+        print(f"[BENCH] N={n:<5} deadline max {run['sender']['deadline_error_max_ms']:8.3f} ms, "
+              f"drops {run['receiver']['kernel_drops']}, "
+              f"rx cpu {run['receiver']['cpu_percent_per_stream']:.3f}%/stream, "
+              f"loss err {run['loss_pct']['abs_error_max']}, "
+              f"{'ok' if run['sustainable'] else 'DEGRADED'}", file=sys.stderr)
+
+    report = {
+        "interval": sender.INTERVAL,
+        "duration": args.duration,
+        "injected_loss_pct": args.loss,
+        "cpu_count": os.cpu_count(),
+        "runs": runs,
+        "max_sustainable_n": max((r["n"] for r in runs if r["sustainable"]), default=0),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+Microbenchmark: create_rtp_packet() against the PacketFactory template path.
+
+    python3 bench_packets.py [packets]
+"""
+import sys
+import timeit
+
+from sender import PAYLOADS, PacketFactory, create_rtp_packet
+
+def bench(label, build, packets):
+    seconds = timeit.timeit(lambda: build(1234, 987654), number=packets)
+    rate = packets / seconds
+    print(f"{label:<22} {1e9 * seconds / packets:9.1f} ns/packet {rate:12,.0f} packets/s")
+    return rate
+
+def main():
+    packets = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    baseline = bench("create_rtp_packet", create_rtp_packet, packets)
+    for mode, payload in PAYLOADS.items():
+        factory = PacketFactory(payload=payload(), stream_id=1)
+        rate = bench(f"PacketFactory[{mode}]", factory.build, packets)
+        print(f"{'':<22} {rate / baseline:9.1f}x baseline")
+
+if __name__ == "__main__":
+    main()
@@ -1,118 +1,1797 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import multiprocessing
+import select
 import socket
 import struct
+import sys
+import json
+import threading
 import time
+import urllib.parse
+import urllib.request
+import warnings
 import numpy as np
-from datetime import datetime, timedelta, timezone
-from prometheus_client import start_http_server, Gauge
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prometheus_client import start_http_server, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily, SummaryMetricFamily
 
-# Prometheus Gauges
-packet_loss_metric = Gauge("rtp_packet_loss_percent", "RTP Packet Loss (%)", ['source_ip'])
-jitter_metric       = Gauge("rtp_jitter_ms", "RTP Jitter (ms)", ['source_ip'])
-mos_metric          = Gauge("rtp_mos_score", "Mean Opinion Score", ['source_ip'])
+# Configuration (each value can be overridden through the environment)
+PORT = int(os.environ.get("PORT", 5004))
+INTERVAL = float(os.environ.get("INTERVAL", 0.02))            # RTP expected interval in seconds
+WINDOW_SECONDS = float(os.environ.get("WINDOW_SECONDS", 60))  # Length of each tumbling stats window
+RECEIVER_WINDOWS = os.environ.get("RECEIVER_WINDOWS", "aligned")  # aligned (wall clock) or per-source
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 8000))
+RECV_BATCH = int(os.environ.get("RECV_BATCH", 64))            # Datagrams drained per receive call
+RECV_BUFFER = int(os.environ.get("RECV_BUFFER", 0))           # SO_RCVBUF in bytes; 0 keeps the kernel default
+SEND_BUFFER = int(os.environ.get("SEND_BUFFER", 0))           # SO_SNDBUF in bytes for reflected probes and agent.py's streams
+KERNEL_TIMESTAMPS = os.environ.get("KERNEL_TIMESTAMPS", "1") == "1"  # Stamp arrivals in the kernel (SO_TIMESTAMPNS)
+REFLECT = os.environ.get("REFLECT", "0") == "1"               # Echo sender probes back for RTT measurement
+RECEIVER_WORKERS = int(os.environ.get("RECEIVER_WORKERS", 1)) # Ingest processes sharing PORT via SO_REUSEPORT
+STREAM_TIMEOUT = float(os.environ.get("STREAM_TIMEOUT", 2))   # Silence after which a source's stream restarts
+RATE = int(os.environ.get("RATE", 8000))                      # RTP timestamp clock rate
+SEQ_WINDOW = int(os.environ.get("SEQ_WINDOW", 128))           # Reorder/duplicate detection depth, in packets
+MAX_DROPOUT = 3000                                            # Larger sequence jumps are treated as a restart
+SERIES_TTL_WINDOWS = int(os.environ.get("SERIES_TTL_WINDOWS", 5))  # Windows without packets before a source's series expire
+AGGREGATOR_URL = os.environ.get("AGGREGATOR_URL", "")        # udp://host:port or http://host:port/summary; empty disables
+RECEIVER_NAME = os.environ.get("RECEIVER_NAME", socket.gethostname())  # This receiver's name in the aggregated matrix
+DESTINATIONS_URL = os.environ.get("DESTINATIONS_URL", "https://raw.githubusercontent.com/ferdaze/Spider-Mon/refs/heads/main/destinations.json")  # Source names; empty labels by IP
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", 300))  # Seconds between source name reloads
+SUMMARY_MTU = 1400                                            # Largest summary datagram pushed over UDP
+HISTORY_FILE = os.environ.get("HISTORY_FILE", "spidermon-history.ring")  # Per-second ring file; empty disables
+HISTORY_SECONDS = int(os.environ.get("HISTORY_SECONDS", 3600))  # Seconds of history kept in the ring
+HISTORY_SOURCES = int(os.environ.get("HISTORY_SOURCES", 256))  # Sources the ring has room for
+HISTORY_PORT = int(os.environ.get("HISTORY_PORT", 8001))      # HTTP port of the history query API
+CODEC = os.environ.get("CODEC", "g711")                       # Codec the MOS is scored for, see CODECS
+JITTER_BUFFER_MS = float(os.environ.get("JITTER_BUFFER_MS", 40))  # Playout buffer; later packets count as lost
+MOS_DELAY = os.environ.get("MOS_DELAY", "none")                # Network delay the MOS counts: none, one-way or a fixed ms
+SKETCH_ACCURACY = float(os.environ.get("SKETCH_ACCURACY", 0.01))  # Relative error of distribution sketches
+SKETCH_MIN_MS = 0.001                                         # Sketch range; values outside are clamped
+SKETCH_MAX_MS = 60000.0
+HISTOGRAM_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+WINDOW_CAPACITY = int(os.environ.get("WINDOW_CAPACITY", 2 * WINDOW_SECONDS / INTERVAL))  # Packets kept per source per window
+WINDOW_CAPACITY_MAX = int(os.environ.get("WINDOW_CAPACITY_MAX", 2 * WINDOW_SECONDS / 0.001))  # Packets a fast profile's row may grow to
 
-def wait_until(target_time):
-    """Pause execution until the specified UTC target time."""
-    now = datetime.now(timezone.utc)
-    delay = (target_time - now).total_seconds()
-    if delay > 0:
-        print(f"[RECEIVER] Waiting {delay:.2f} seconds until next test...")
-        time.sleep(delay)
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_LOG_GAMMA = np.log(SKETCH_GAMMA)
+SKETCH_BINS = int(np.ceil(np.log(SKETCH_MAX_MS / SKETCH_MIN_MS) / SKETCH_LOG_GAMMA)) + 1
+SKETCH_BOUNDS = SKETCH_MIN_MS * SKETCH_GAMMA ** np.arange(SKETCH_BINS)
+# Last sketch bucket lying entirely below each exported histogram bound.
+HISTOGRAM_BUCKET_INDEX = [int(np.searchsorted(SKETCH_BOUNDS, le * (1 + 1e-9), side='right')) - 1 for le in HISTOGRAM_BUCKETS_MS]
 
-def calculate_mos(packet_loss, jitter):
+# Per-window results exported by ResultsCollector: result key -> (metric, help)
+WINDOW_METRICS = {
+    'loss_pct':            ("rtp_packet_loss_percent", "RTP Packet Loss (%)"),
+    'jitter_ms':           ("rtp_jitter_ms", "RTP Interarrival Jitter, RFC 3550 (ms)"),
+    'mos':                 ("rtp_mos_score", "Mean Opinion Score"),
+    'r_factor':            ("rtp_r_factor", "G.107 E-model transmission rating R"),
+    'effective_loss_pct':  ("rtp_effective_loss_percent", "Packet loss including jitter buffer discards (%)"),
+    'late_discards':       ("rtp_jitter_buffer_discards", "RTP packets too late for the playout buffer in the last window"),
+    'received':            ("rtp_packets_received", "RTP packets received in the last window"),
+    'lost':                ("rtp_packets_lost", "RTP packets lost in the last window"),
+    'duplicates':          ("rtp_packets_duplicated", "Duplicate RTP packets in the last window"),
+    'reordered':           ("rtp_packets_reordered", "Late/reordered RTP packets in the last window"),
+    'loss_bursts':         ("rtp_loss_bursts", "Runs of consecutive lost RTP packets in the last window"),
+    'burst_max':           ("rtp_loss_burst_max", "Longest run of consecutive lost RTP packets in the last window"),
+    'burst_ratio':         ("rtp_loss_burst_ratio", "G.113 burst ratio of RTP packet loss (1 for random loss)"),
+    'ssrc_changes':        ("rtp_ssrc_changes", "New SSRCs from a source address while its previous stream was active, in the last window"),
+    'sequence_resets':     ("rtp_sequence_resets", "Mid-stream RTP sequence number resets in the last window"),
+    'delay_ms':            ("rtp_one_way_delay_ms", "Mean one-way delay from sender timestamps (ms)"),
+    'delay_min_ms':        ("rtp_one_way_delay_min_ms", "Minimum one-way delay (ms)"),
+    'delay_p95_ms':        ("rtp_one_way_delay_p95_ms", "95th percentile one-way delay (ms)"),
+    'delay_p99_ms':        ("rtp_one_way_delay_p99_ms", "99th percentile one-way delay (ms)"),
+    'delay_max_ms':        ("rtp_one_way_delay_max_ms", "Maximum one-way delay (ms)"),
+    'jitter_mean_ms':      ("rtp_jitter_mean_ms", "Mean RTP transit variation (ms)"),
+    'jitter_p50_ms':       ("rtp_jitter_p50_ms", "Median RTP transit variation (ms)"),
+    'jitter_p95_ms':       ("rtp_jitter_p95_ms", "95th percentile RTP transit variation (ms)"),
+    'jitter_p99_ms':       ("rtp_jitter_p99_ms", "99th percentile RTP transit variation (ms)"),
+    'jitter_max_ms':       ("rtp_jitter_max_ms", "Maximum RTP transit variation (ms)"),
+    'interarrival_ms':     ("rtp_interarrival_ms", "Mean packet inter-arrival time (ms)"),
+    'interarrival_std_ms': ("rtp_interarrival_stddev_ms", "Packet inter-arrival standard deviation (ms)"),
+}
+
+# Per-packet distributions kept as sketches and exported as histograms
+DISTRIBUTIONS = {
+    'jitter': ("rtp_jitter_distribution_ms", "Per-packet RTP transit variation (ms)"),
+    'delay':  ("rtp_one_way_delay_distribution_ms", "Per-packet one-way delay (ms)"),
+}
+
+# G.107 E-model codec profiles (G.113 appendix I): equipment impairment
+# Ie, packet-loss robustness Bpl and algorithmic (look-ahead) delay in ms.
+CODECS = {
+    'g711':       {'ie': 0.0,  'bpl': 25.1, 'lookahead_ms': 0.0},   # with packet loss concealment
+    'g711-noplc': {'ie': 0.0,  'bpl': 4.3,  'lookahead_ms': 0.0},
+    'g729a':      {'ie': 11.0, 'bpl': 19.0, 'lookahead_ms': 5.0},
+    'g723.1':     {'ie': 15.0, 'bpl': 16.1, 'lookahead_ms': 7.5},
+    'amr-12.2':   {'ie': 5.0,  'bpl': 10.0, 'lookahead_ms': 5.0},
+}
+if CODEC not in CODECS:
+    # Fail at startup rather than on the first window close.
+    raise ValueError(f"Unknown CODEC {CODEC!r}, expected one of {', '.join(CODECS)}")
+if MOS_DELAY not in ('none', 'one-way'):
+    try:
+        MOS_DELAY = float(MOS_DELAY)
+    except ValueError:
+        raise ValueError(f"MOS_DELAY must be none, one-way or milliseconds, not {MOS_DELAY!r}") from None
+
+# E-model terms at the G.107 default settings (SLR 8, RLR 2, STMR 15,
+# TELR 65, WEPL 110, Ds = Dr = 3, default noise): basic signal-to-noise
+# ratio Ro, simultaneous impairment Is and the noise term in Roe.
+EMODEL_RO = 94.77
+EMODEL_IS = 1.43
+EMODEL_TELR = 65.0
+EMODEL_WEPL = 110.0
+EMODEL_ROE = 94.77
+
+def emodel_r(loss_pct, delay_ms=0.0, burst_ratio=1.0, codec=CODEC):
     """
-    Estimate MOS score from packet loss (%) and jitter (ms) using G.107 approximation.
+    G.107 E-model rating R = Ro - Is - Id - Ie,eff (advantage factor 0)
+    for arrays of packet loss (%), mouth-to-ear delay (ms) and burst ratio,
+    all broadcast together. Id covers talker echo, listener echo and
+    absolute delay with the default echo path (T = Ta, Tr = 2T).
     """
-    r = 93.2 - packet_loss * 2.5 - jitter * 0.1
-    r = max(0.0, min(r, 100.0))
-    mos = 1 + 0.035 * r + (r * (r - 60) * (100 - r) * 7e-6)
-    return max(min(mos, 4.5), 1.0)
+    profile = CODECS[codec]
+    ppl = np.asarray(loss_pct, dtype=np.float64)
+    t = np.maximum(np.asarray(delay_ms, dtype=np.float64), 0.0)
+    burst_ratio = np.maximum(np.asarray(burst_ratio, dtype=np.float64), 1.0)
+
+    terv = EMODEL_TELR - 40 * np.log10((1 + t / 10) / (1 + t / 150)) + 6 * np.exp(-0.3 * t ** 2)
+    re = 80 + 2.5 * (terv - 14)
+    idte = ((EMODEL_ROE - re) / 2 + np.sqrt((EMODEL_ROE - re) ** 2 / 4 + 100) - 1) * (1 - np.exp(-t))
+    rle = 10.5 * (EMODEL_WEPL + 7) * (2 * t + 1) ** -0.25
+    idle = (EMODEL_RO - rle) / 2 + np.sqrt((EMODEL_RO - rle) ** 2 / 4 + 169)
+    x = np.log2(np.maximum(t, 100.0) / 100)
+    idd = 25 * ((1 + x ** 6) ** (1 / 6) - 3 * (1 + (x / 3) ** 6) ** (1 / 6) + 2)
+
+    ie_eff = profile['ie'] + (95 - profile['ie']) * ppl / (ppl / burst_ratio + profile['bpl'])
+    return EMODEL_RO - EMODEL_IS - (idte + idle + idd) - ie_eff
+
+def r_to_mos(r):
+    """G.107 annex B mapping from rating R to MOS (CQE)."""
+    r = np.clip(r, 0.0, 100.0)
+    return np.clip(1 + 0.035 * r + r * (r - 60) * (100 - r) * 7e-6, 1.0, 4.5)
 
-def receive_rtp_once():
+def calculate_mos(loss_pct, delay_ms=0.0, burst_ratio=1.0, codec=CODEC):
+    """MOS from the E-model rating; arrays in, array out (see emodel_r())."""
+    return r_to_mos(emodel_r(loss_pct, delay_ms, burst_ratio, codec))
+
+def burst_ratio(lost, expected, bursts, burst_lost):
     """
-    Run a single 45-second RTP listening session and update Prometheus metrics.
+    G.113 BurstR: mean observed loss burst length over the mean expected
+    for random loss at the same rate, 1 / (1 - p). 1 for random loss.
     """
-    start_log_ts = datetime.now(timezone.utc).isoformat()
-    print(f"[RECEIVER] RTP test started at {start_log_ts}Z")
+    if not bursts or not expected or lost >= expected:
+        return 1.0
+    return max(burst_lost / bursts * (1 - lost / expected), 1.0)
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('', PORT))
-    sock.settimeout(DURATION + 5)
+RTP_HEADER = struct.Struct('!HHLL')
+# Probe block the sender puts at the start of the payload (see sender.py).
+PROBE = struct.Struct('!4sLQ')
+PROBE_MAGIC = b'SPDM'
+ECHO_MAGIC = b'SPDE'
+PROBE_END = RTP_HEADER.size + PROBE.size
+# Stream profile tag after the probe: magic, name length, name (see sender.py).
+PROFILE_TAG = struct.Struct('!4sB')
+PROFILE_MAGIC = b'SPCL'
+DEFAULT_PROFILE = 'default'
+NO_DELAY = float('nan')
+SEQ_WINDOW_MASK = (1 << SEQ_WINDOW) - 1
+
+class JitterEstimator:
+    """
+    RFC 3550 interarrival jitter (section 6.4.1), kept in RTP timestamp
+    units: J += (|D(i-1, i)| - J) / 16. State is O(1) per stream.
+    """
+
+    __slots__ = ('transit', 'jitter')
+
+    def __init__(self):
+        self.transit = None
+        self.jitter = 0.0
+
+    def update(self, arrival, ts):
+        transit = arrival * RATE - ts
+        if self.transit is not None:
+            d = (transit - self.transit + 2**31) % 2**32 - 2**31
+            self.jitter += (abs(d) - self.jitter) / 16
+        self.transit = transit
+
+    def jitter_ms(self):
+        return 1000.0 * self.jitter / RATE
+
+class SequenceTracker:
+    """
+    Reorder- and duplicate-aware loss accounting for one stream.
+
+    Sequence numbers are extended with a wrap count (RFC 3550 appendix A.1)
+    and the last SEQ_WINDOW packets are kept as a bitmap, bit i standing for
+    extended sequence highest - i. Each packet is O(1): an in-window
+    reorder or duplicate is one bit test, an advance is one shift, and the
+    bits shifted out are final, which is where loss bursts are measured.
+    Only the lowest `depth` bits lie inside the stream; a packet from
+    before the first one moves the start back, as the base sequence of
+    appendix A.3 does. Loss per window is expected minus unique received.
+    """
+
+    __slots__ = ('highest', 'bitmap', 'depth', 'bad_seq', 'run', 'expected', 'received', 'duplicates', 'late',
+                 'bursts', 'burst_lost', 'burst_max', 'resets', 'ssrc_changes')
+
+    def __init__(self):
+        self.highest = None
+        self.bitmap = 0
+        self.depth = 0
+        self.bad_seq = None
+        self.run = 0
+        self._reset_counters()
+
+    def restart(self):
+        """Start a new sequence space, finalising what is left of the old one."""
+        if self.highest is not None:
+            self._retire(self._settled(), SEQ_WINDOW)
+            self._end_run()
+        if self.bad_seq is not None:
+            self.late += 1
+        self.highest = None
+        self.bitmap = 0
+        self.depth = 0
+        self.bad_seq = None
+
+    def _settled(self):
+        # Positions before the stream's start read as received so that
+        # shifting them out never counts as loss.
+        return self.bitmap | (SEQ_WINDOW_MASK & ~((1 << self.depth) - 1))
+
+    def update(self, seq):
+        if self.highest is None:
+            self.highest = seq
+            self.bitmap = 1
+            self.depth = 1
+            self.expected += 1
+            self.received += 1
+            return
+        if self.bad_seq is not None and seq != self.bad_seq:
+            # The far-off packet before this one was a stray, not a restart.
+            self.late += 1
+            self.bad_seq = None
+        delta = (seq - self.highest) & 0xFFFF
+        if 0 < delta < MAX_DROPOUT:
+            self._advance(delta)
+            self.highest += delta
+            self.bad_seq = None
+        elif delta == 0 or 0x10000 - delta < SEQ_WINDOW:
+            offset = 0x10000 - delta if delta else 0
+            bit = 1 << offset
+            if offset >= self.depth:
+                # Older than the first packet: the stream started earlier.
+                self.expected += offset + 1 - self.depth
+                self.depth = offset + 1
+            if self.bitmap & bit:
+                self.duplicates += 1
+            else:
+                self.bitmap |= bit
+                self.received += 1
+                self.late += 1
+        elif seq == self.bad_seq:
+            # Two sequential packets after a large jump: the sender restarted.
+            self.bad_seq = None
+            self.restart()
+            self.resets += 1
+            self.update((seq - 1) & 0xFFFF)
+            self.update(seq)
+        else:
+            # A stray far outside the window: wait for a second packet to
+            # tell a restart from a stray, which is then counted as late.
+            self.bad_seq = (seq + 1) & 0xFFFF
+
+    def _advance(self, delta):
+        if delta >= SEQ_WINDOW:
+            self._retire(self._settled(), SEQ_WINDOW)
+            self.run += delta - SEQ_WINDOW
+            self.bitmap = 1
+        else:
+            self._retire(self._settled() >> (SEQ_WINDOW - delta), delta)
+            self.bitmap = ((self.bitmap << delta) | 1) & SEQ_WINDOW_MASK
+        self.depth = min(self.depth + delta, SEQ_WINDOW)
+        self.expected += delta
+        self.received += 1
+
+    def _retire(self, bits, n):
+        """Account n bits leaving the window, oldest (bit n-1) first."""
+        if n == 1:
+            if bits & 1:
+                self._end_run()
+            else:
+                self.run += 1
+            return
+        for i in range(n - 1, -1, -1):
+            if (bits >> i) & 1:
+                self._end_run()
+            else:
+                self.run += 1
+
+    def _end_run(self):
+        if self.run:
+            self.bursts += 1
+            self.burst_lost += self.run
+            if self.run > self.burst_max:
+                self.burst_max = self.run
+            self.run = 0
+
+    def snapshot(self):
+        """Return this window's counters and reset them."""
+        counts = {
+            'expected': self.expected,
+            'lost': max(self.expected - self.received, 0),
+            'duplicates': self.duplicates,
+            'reordered': self.late,
+            'loss_bursts': self.bursts,
+            'burst_max': self.burst_max,
+            'burst_ratio': burst_ratio(max(self.expected - self.received, 0), self.expected, self.bursts, self.burst_lost),
+            'sequence_resets': self.resets,
+            'ssrc_changes': self.ssrc_changes,
+        }
+        self._reset_counters()
+        return counts
+
+    def _reset_counters(self):
+        self.expected = self.received = self.duplicates = self.late = 0
+        self.bursts = self.burst_lost = self.burst_max = 0
+        self.resets = self.ssrc_changes = 0
+
+class SourceState:
+    """Per-stream state that outlives a window: RFC 3550 jitter and sequence tracking."""
+
+    __slots__ = ('ssrc', 'profile', 'last_arrival', 'jitter', 'sequence')
+
+    def __init__(self):
+        self.ssrc = None
+        self.profile = DEFAULT_PROFILE
+        self.last_arrival = None
+        self.jitter = JitterEstimator()
+        self.sequence = SequenceTracker()
+
+    def update(self, arrival, seq, ts, ssrc):
+        if ssrc != self.ssrc:
+            # A new stream: the first one, or one that took over the row of
+            # a quiet stream (see PacketStore.stream_row()).
+            self.ssrc = ssrc
+            self.jitter = JitterEstimator()
+            self.sequence.restart()
+        elif arrival - self.last_arrival > STREAM_TIMEOUT:
+            # A new test from the same sender: sequence numbers start over.
+            self.jitter.transit = None
+            self.sequence.restart()
+        self.last_arrival = arrival
+        self.jitter.update(arrival, ts)
+        self.sequence.update(seq)
+
+class RowBlock:
+    """
+    Packet rings of one capacity class of a PacketStore: arrival /
+    timestamp / one-way delay / sequence arrays with one row per stream.
+    """
+
+    def __init__(self, capacity, rows):
+        self.capacity = capacity
+        self.arrival = np.zeros((rows, capacity), dtype=np.float64)
+        self.ts = np.zeros((rows, capacity), dtype=np.int64)
+        self.delay = np.zeros((rows, capacity), dtype=np.float64)
+        self.seq = np.zeros((rows, capacity), dtype=np.int32)
+        self.free = list(range(rows - 1, -1, -1))
+
+    def take(self):
+        if not self.free:
+            old = len(self.arrival)
+            for name in ('arrival', 'ts', 'delay', 'seq'):
+                column = getattr(self, name)
+                setattr(self, name, np.concatenate([column, np.zeros_like(column)]))
+            self.free.extend(range(2 * old - 1, old - 1, -1))
+        return self.free.pop()
+
+class PacketStore:
+    """
+    Columnar per-stream packet log for the current window.
+
+    Each stream owns one row of preallocated arrival / timestamp / one-way
+    delay / sequence ring arrays plus a SourceState, so ingesting a packet
+    is a dict lookup, the O(1) state update and four array writes.
+    Distribution statistics are computed in analyze_window() when the
+    window closes. Rows start in a block of `capacity` packets; a stream
+    that fills its row (a profile faster than INTERVAL) moves to a block
+    of twice the capacity, up to max_capacity, past which the row keeps
+    the newest packets. Each block is analysed on its own, so one fast
+    stream costs only its own row.
+    """
+
+    def __init__(self, capacity=WINDOW_CAPACITY, rows=16, max_capacity=WINDOW_CAPACITY_MAX):
+        self.capacity = capacity
+        self.max_capacity = max(capacity, max_capacity)
+        self.blocks = {capacity: RowBlock(capacity, rows)}
+        self.block = [None] * rows
+        self.slot = [0] * rows
+        self.counts = [0] * rows
+        self.started = [0.0] * rows
+        self.state = [None] * rows
+        self.rows = {}
+        self.free = list(range(rows - 1, -1, -1))
+        self.streams = {}
+        self.aliases = {}
+        self.peers = {}
+
+    def row(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            if not self.free:
+                self._grow()
+            row = self.rows[key] = self.free.pop()
+            block = self.block[row] = self.blocks[self.capacity]
+            self.slot[row] = block.take()
+            self.state[row] = SourceState()
+        return row
+
+    def stream_row(self, addr, ssrc, data, arrival):
+        """
+        Row of the stream keyed (source address, SSRC), data being its
+        packet arriving at `arrival`. A new SSRC from an address whose
+        latest stream of the same profile has been quiet for STREAM_TIMEOUT
+        takes over that stream's row: a sender's next test or a restart on
+        the same socket continues the series, and the SourceState starts
+        the sequence over. While that stream is still active the new SSRC
+        gets a row of its own and is counted as an SSRC change.
+        """
+        key = (addr, ssrc)
+        row = self.rows.get(key)
+        if row is not None:
+            return row
+        profile = stream_profile(data)
+        alias = (addr, profile)
+        previous = self.streams.get(alias)
+        peers = self.peers.setdefault((addr[0], profile), set())
+        if previous is not None and arrival - self.state[self.rows[previous]].last_arrival > STREAM_TIMEOUT:
+            row = self.rows[key] = self.rows.pop(previous)
+            del self.aliases[previous]
+            peers.discard(previous)
+        else:
+            row = self.row(key)
+            self.state[row].profile = profile
+            if previous is not None:
+                self.state[row].sequence.ssrc_changes += 1
+        self.streams[alias] = key
+        self.aliases[key] = alias
+        peers.add(key)
+        return row
+
+    def sharing(self, key):
+        """
+        (port_shared, ssrc_shared): whether another stream of the same
+        address and profile was active within STREAM_TIMEOUT of this one,
+        from another port or from the same one.
+        """
+        state = self.state[self.rows[key]]
+        (ip, port), _ = key
+        port_shared = ssrc_shared = False
+        for other in self.peers.get((ip, state.profile), ()):
+            if other == key or self.state[self.rows[other]].last_arrival < state.last_arrival - STREAM_TIMEOUT:
+                continue
+            if other[0][1] == port:
+                ssrc_shared = True
+            else:
+                port_shared = True
+        return port_shared, ssrc_shared
+
+    def _grow(self):
+        old = len(self.counts)
+        self.block.extend([None] * old)
+        self.slot.extend([0] * old)
+        self.counts.extend([0] * old)
+        self.started.extend([0.0] * old)
+        self.state.extend([None] * old)
+        self.free.extend(range(2 * old - 1, old - 1, -1))
+
+    def _promote(self, row):
+        # Only called on a full row that has not wrapped yet, so its
+        # packets are still in order from column 0.
+        old, slot = self.block[row], self.slot[row]
+        capacity = min(2 * old.capacity, self.max_capacity)
+        block = self.blocks.get(capacity)
+        if block is None:
+            block = self.blocks[capacity] = RowBlock(capacity, 1)
+        wide = block.take()
+        for name in ('arrival', 'ts', 'delay', 'seq'):
+            getattr(block, name)[wide, :old.capacity] = getattr(old, name)[slot]
+        old.free.append(slot)
+        self.block[row], self.slot[row] = block, wide
+        return block
+
+    def append(self, row, arrival, seq, ts, ssrc, delay):
+        self.state[row].update(arrival, seq, ts, ssrc)
+        n = self.counts[row]
+        block = self.block[row]
+        if not n:
+            self.started[row] = arrival
+        elif n == block.capacity < self.max_capacity:
+            block = self._promote(row)
+        i = n % block.capacity
+        slot = self.slot[row]
+        block.arrival[slot, i] = arrival
+        block.ts[slot, i] = ts
+        block.delay[slot, i] = delay
+        block.seq[slot, i] = seq
+        self.counts[row] = n + 1
+
+    def drain(self, keys=None):
+        """
+        Return one (keys, totals, states, starts, arrival, ts, delay, seq,
+        counts) group per capacity block for the given sources (default:
+        every source seen this window), oldest packet first, and reset
+        their windows. When draining everything, sources with no packets
+        are released.
+        """
+        if keys is None:
+            for key, row in list(self.rows.items()):
+                if not self.counts[row]:
+                    self.release(key)
+            keys = list(self.rows)
+        by_block = {}
+        for key in keys:
+            row = self.rows[key]
+            by_block.setdefault(self.block[row].capacity, []).append((key, row))
+        groups = []
+        for capacity, members in sorted(by_block.items()):
+            block = self.blocks[capacity]
+            group_keys = [key for key, _ in members]
+            rows = [row for _, row in members]
+            slots = np.array([self.slot[r] for r in rows], dtype=np.intp)
+            totals = np.array([self.counts[r] for r in rows], dtype=np.int64)
+            counts = np.minimum(totals, capacity)
+            cols = int(counts.max())
+            # Rows that overflowed the ring start at their oldest surviving entry.
+            start = np.where(totals > capacity, totals % capacity, 0)
+            idx = (start[:, None] + np.arange(cols)) % capacity
+            columns = [np.take_along_axis(c[slots], idx, axis=1) for c in (block.arrival, block.ts, block.delay, block.seq)]
+            groups.append((group_keys, totals, [self.state[r] for r in rows], [self.started[r] for r in rows], *columns, counts))
+            for r in rows:
+                self.counts[r] = 0
+        return groups
+
+    def release(self, key):
+        row = self.rows.pop(key)
+        alias = self.aliases.pop(key, None)
+        if alias is not None and self.streams.get(alias) == key:
+            del self.streams[alias]
+        if alias is not None:
+            peers = self.peers[(alias[0][0], alias[1])]
+            peers.discard(key)
+            if not peers:
+                del self.peers[(alias[0][0], alias[1])]
+        self.block[row].free.append(self.slot[row])
+        self.block[row] = None
+        self.state[row] = None
+        self.free.append(row)
+
+    def due(self, now, window=WINDOW_SECONDS):
+        """
+        Sources whose own window should close: (full, idle) keys for windows
+        that have run for `window` seconds and for streams silent for
+        STREAM_TIMEOUT, i.e. a test that has ended.
+        """
+        full, idle = [], []
+        for key, row in self.rows.items():
+            if not self.counts[row]:
+                continue
+            if now - self.state[row].last_arrival > STREAM_TIMEOUT:
+                idle.append(key)
+            elif now - self.started[row] >= window:
+                full.append(key)
+        return full, idle
+
+    def expire(self, now):
+        """
+        Release streams silent for STREAM_TIMEOUT that have nothing left to
+        report, e.g. one whose window closed full just before it ended.
+        """
+        for key in [k for k, row in self.rows.items()
+                    if not self.counts[row] and now - self.state[row].last_arrival > STREAM_TIMEOUT]:
+            self.release(key)
+
+def _masked_stats(values, mask, empty=0.0):
+    """
+    Mean, max and p50/p95/p99 of each row of values restricted to mask;
+    rows with nothing under the mask get empty.
+    """
+    n = mask.sum(axis=1)
+    masked = np.where(mask, values, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN rows
+        mean = np.where(n > 0, np.where(mask, values, 0.0).sum(axis=1) / np.maximum(n, 1), empty)
+        peak = np.where(n > 0, np.where(mask, values, -np.inf).max(axis=1, initial=-np.inf), empty)
+        if masked.size:
+            pct = np.where(n > 0, np.nan_to_num(np.nanpercentile(masked, [50, 95, 99], axis=1)), empty)
+        else:
+            pct = np.zeros((3, len(n)))
+    return mean, peak, pct
+
+def analyze_window(arrival, ts, delay, seq, counts):
+    """
+    Jitter, inter-arrival and one-way delay distributions for every source
+    of a window in one vectorized pass over (sources x packets) arrays.
+    Returns per-source statistics, per-source jitter / delay sketches and
+    per-source per-second history (see per_second()).
+    """
+    cols = arrival.shape[1]
+    valid = np.arange(cols) < counts[:, None]
+    gap = np.diff(arrival, axis=1)
+    # A silence longer than STREAM_TIMEOUT is a sender restart: its
+    # timestamps start over and must not be compared across it.
+    same_stream = valid[:, 1:] & (gap <= STREAM_TIMEOUT)
+
+    # Transit variation between consecutive packets (RFC 3550 D(i-1, i)).
+    dts = (np.diff(ts, axis=1) + 2**31) % 2**32 - 2**31
+    variation = np.abs(gap - dts / RATE) * 1000
+    jitter_mean, jitter_max, jitter_pct = _masked_stats(variation, same_stream)
+    gap_ms = gap * 1000
+    iat_mean, iat_max, _ = _masked_stats(gap_ms, same_stream)
+    n = np.maximum(same_stream.sum(axis=1), 1)
+    iat_std = np.sqrt(np.where(same_stream, (gap_ms - iat_mean[:, None]) ** 2, 0.0).sum(axis=1) / n)
+    # The stream's packet interval, from the timestamp step between
+    # consecutive sequence numbers; profiles differ from INTERVAL.
+    dseq = (np.diff(seq.astype(np.int64), axis=1) + 0x8000) % 0x10000 - 0x8000
+    _, _, step_pct = _masked_stats(dts * 1000 / RATE, same_stream & (dseq == 1), empty=INTERVAL * 1000)
+
+    # Playout buffer: transit relative to the fastest packet of the window;
+    # anything more than JITTER_BUFFER_MS behind it misses its playout time.
+    transit = np.cumsum(np.where(same_stream, gap - dts / RATE, 0.0), axis=1)
+    transit = np.concatenate([np.zeros((len(counts), 1)), transit], axis=1)
+    fastest = np.where(valid, transit, np.inf).min(axis=1, initial=np.inf)
+    late = valid & ((transit - fastest[:, None]) * 1000 > JITTER_BUFFER_MS)
+
+    # One-way delay needs synchronised clocks; packets without a probe are NaN.
+    probed = valid & ~np.isnan(delay)
+    delay_ms = delay * 1000
+    delay_mean, delay_max, delay_pct = _masked_stats(delay_ms, probed, empty=np.nan)
+    delay_min = np.where(probed.any(axis=1), np.where(probed, delay_ms, np.inf).min(axis=1, initial=np.inf), np.nan)
+
+    return {
+        'jitter_mean_ms': jitter_mean,
+        'jitter_p50_ms': jitter_pct[0],
+        'jitter_p95_ms': jitter_pct[1],
+        'jitter_p99_ms': jitter_pct[2],
+        'jitter_max_ms': jitter_max,
+        'interarrival_ms': iat_mean,
+        'interarrival_std_ms': iat_std,
+        'interarrival_max_ms': iat_max,
+        'packet_interval_ms': step_pct[0],
+        'late_discards': late.sum(axis=1),
+        'delay_ms': delay_mean,
+        'delay_min_ms': delay_min,
+        'delay_p50_ms': delay_pct[0],
+        'delay_p95_ms': delay_pct[1],
+        'delay_p99_ms': delay_pct[2],
+        'delay_max_ms': delay_max,
+    }, {
+        'jitter': QuantileSketch.from_rows(variation, same_stream),
+        'delay': QuantileSketch.from_rows(delay_ms, probed),
+    }, [per_second(arrival[r, :counts[r]], seq[r, :counts[r]], variation[r, :max(counts[r] - 1, 0)],
+                   same_stream[r, :max(counts[r] - 1, 0)], delay_ms[r, :counts[r]])
+        for r in range(len(counts))]
+
+def per_second(arrival, seq, variation, same_stream, delay_ms):
+    """
+    One source's window broken down by wall-clock second: (seconds,
+    received, lost, mean transit variation in ms, mean delay in ms), the
+    last two NaN for seconds without data. Loss per second is the advance
+    of the highest extended sequence number minus the packets received.
+    """
+    if not len(arrival):
+        empty = np.zeros(0)
+        return np.zeros(0, dtype=np.int64), empty, empty, empty, empty
+    second = np.floor(arrival).astype(np.int64)
+    first = int(second.min())
+    idx = second - first
+    n = int(idx.max()) + 1
+    received = np.bincount(idx, minlength=n)
+
+    # Extend sequence numbers across wraps; a sender restart (a silence or
+    # a jump beyond MAX_DROPOUT) counts as one step rather than a loss.
+    step = (np.diff(seq.astype(np.int64)) + 0x8000) % 0x10000 - 0x8000
+    step = np.where(same_stream & (np.abs(step) < MAX_DROPOUT), step, 1)
+    extended = np.concatenate([[0], np.cumsum(step)])
+    highest = np.full(n, -np.inf)
+    np.maximum.at(highest, idx, extended)
+    highest = np.maximum.accumulate(highest)
+    advance = np.diff(highest, prepend=extended.min() - 1)
+    lost = np.maximum(advance - received, 0)
+
+    later = idx[1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jitter = np.bincount(later, np.where(same_stream, variation, 0.0), minlength=n) / np.bincount(later, same_stream, minlength=n)
+        probed = ~np.isnan(delay_ms)
+        delay = np.bincount(idx, np.where(probed, delay_ms, 0.0), minlength=n) / np.bincount(idx, probed, minlength=n)
+    return first + np.arange(n), received, lost, jitter, delay
+
+class QuantileSketch:
+    """
+    Fixed-memory, mergeable quantile sketch in the style of DDSketch.
+
+    Values (ms) fall into SKETCH_BINS log-spaced buckets, bucket i holding
+    (SKETCH_MIN_MS * gamma**(i-1), SKETCH_MIN_MS * gamma**i], so any quantile
+    is answered within SKETCH_ACCURACY relative error. Values at or below
+    SKETCH_MIN_MS (including negative one-way delays from skewed clocks)
+    share bucket 0 and values above the range share the last bucket.
+    Merging two sketches is adding their bucket counts.
+    """
+
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = np.zeros(SKETCH_BINS, dtype=np.int64) if counts is None else counts
+        self.count = int(self.counts.sum())
+        self.sum = total
+
+    @staticmethod
+    def bucket_index(values):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            idx = np.ceil(np.log(np.maximum(values, SKETCH_MIN_MS) / SKETCH_MIN_MS) / SKETCH_LOG_GAMMA)
+        return np.clip(np.nan_to_num(idx), 0, SKETCH_BINS - 1).astype(np.intp)
+
+    @staticmethod
+    def from_rows(values, mask):
+        """One sketch per row of values, built for all rows in a single bincount."""
+        rows = values.shape[0]
+        idx = QuantileSketch.bucket_index(np.where(mask, values, 0.0))
+        flat = (np.arange(rows)[:, None] * SKETCH_BINS + idx)[mask]
+        counts = np.bincount(flat, minlength=rows * SKETCH_BINS).reshape(rows, SKETCH_BINS)
+        sums = np.where(mask, values, 0.0).sum(axis=1)
+        return [QuantileSketch(counts[r], float(sums[r])) for r in range(rows)]
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        if not self.count:
+            return float('nan')
+        i = int(np.searchsorted(np.cumsum(self.counts), q * (self.count - 1), side='right'))
+        return float(2 * SKETCH_BOUNDS[min(i, SKETCH_BINS - 1)] / (SKETCH_GAMMA + 1))
+
+    def histogram(self):
+        """Cumulative (le, count) pairs at HISTOGRAM_BUCKETS_MS, ending with +Inf."""
+        cumulative = np.cumsum(self.counts)
+        buckets = [(str(le), float(cumulative[i])) for le, i in zip(HISTOGRAM_BUCKETS_MS, HISTOGRAM_BUCKET_INDEX)]
+        buckets.append(('+Inf', float(self.count)))
+        return buckets
+
+class ResultsCollector:
+    """
+    Prometheus collector serving the latest window of every live source.
+
+    Each sample carries the timestamp of the window it came from. A source
+    with no window ending in the last SERIES_TTL_WINDOWS * WINDOW_SECONDS
+    is dropped, so the scrape only ever covers live peers. Jitter and
+    delay sketches are merged into cumulative per-source sketches and
+    exported as histograms, so p50/p95/p99 across sources and time come
+    from histogram_quantile().
+    """
+
+    def __init__(self, ttl=SERIES_TTL_WINDOWS * WINDOW_SECONDS):
+        self.ttl = ttl
+        self.series = {}
+        self.sketches = {}
+        self.lock = threading.Lock()
+
+    def update(self, now, results):
+        with self.lock:
+            for r in results:
+                series = (r['source'], r['profile'])
+                self.series[series] = {'window_end': r['window_end'], 'result': r}
+                sketches = self.sketches.setdefault(series, {})
+                for name in DISTRIBUTIONS:
+                    sketch = r[f'{name}_sketch']
+                    if name in sketches:
+                        sketches[name].merge(sketch)
+                    else:
+                        sketches[name] = QuantileSketch(sketch.counts.copy(), sketch.sum)
+            self._expire(now)
+
+    def _expire(self, now):
+        for series in [k for k, e in self.series.items() if now - e['window_end'] >= self.ttl]:
+            print(f"[RECEIVER] No packets from {series_name(*series)} for {now - self.series[series]['window_end']:.0f} s, "
+                  f"expiring its series")
+            del self.series[series]
+            self.sketches.pop(series, None)
+
+    def collect(self):
+        with self.lock:
+            # Also expire here: in per-source mode no window closes once
+            # every source has gone quiet, so update() alone never runs.
+            self._expire(time.time())
+            series = [((*key, e['result']['source_ip']), e['window_end'], e['result']) for key, e in self.series.items()]
+            histograms = {
+                name: [(labels, self.sketches[labels[:2]][name].histogram(), self.sketches[labels[:2]][name].sum, window_end)
+                       for labels, window_end, _ in series]
+                for name in DISTRIBUTIONS
+            }
+        for key, (metric, documentation) in WINDOW_METRICS.items():
+            family = GaugeMetricFamily(metric, documentation, labels=['source', 'profile', 'source_ip'])
+            for labels, window_end, result in series:
+                family.add_metric(labels, result[key], timestamp=window_end)
+            yield family
+        for name, (metric, documentation) in DISTRIBUTIONS.items():
+            family = HistogramMetricFamily(metric, documentation, labels=['source', 'profile', 'source_ip'])
+            for labels, buckets, total, window_end in histograms[name]:
+                family.add_metric(labels, buckets, total, timestamp=window_end)
+            yield family
+
+collector = ResultsCollector()
+REGISTRY.register(collector)
+
+class IngestHealth:
+    """
+    The ingest loop's measurements of itself. Values live in a shared array
+    so the parent of RECEIVER_WORKERS processes can export every worker's
+    figures without any messages.
+    """
+
+    FIELDS = ('packets', 'ingest_seconds', 'kernel_drops', 'windows', 'window_seconds',
+              'loop_lag', 'loop_lag_max', 'queue_bytes', 'buffer_bytes')
+    PACKETS, INGEST_SECONDS, KERNEL_DROPS, WINDOWS, WINDOW_SECONDS, LOOP_LAG, LOOP_LAG_MAX, QUEUE_BYTES, BUFFER_BYTES = range(9)
+
+    def __init__(self):
+        self.values = multiprocessing.RawArray('d', len(self.FIELDS))
+
+    def record_batch(self, packets, seconds, drops):
+        v = self.values
+        v[self.PACKETS] += packets
+        v[self.INGEST_SECONDS] += seconds
+        v[self.KERNEL_DROPS] = drops
 
-    buffers = {}
-    start_time = time.time()
+    def record_window(self, seconds):
+        v = self.values
+        v[self.WINDOWS] += 1
+        v[self.WINDOW_SECONDS] += seconds
 
-    while time.time() - start_time < DURATION:
+    def record_check(self, lag, sock):
+        """Loop lag at a scheduled window check, plus the socket's state."""
+        v = self.values
+        v[self.LOOP_LAG] = lag
+        if lag > v[self.LOOP_LAG_MAX]:
+            v[self.LOOP_LAG_MAX] = lag
+        v[self.QUEUE_BYTES] = socket_queue_bytes(sock)
+        v[self.BUFFER_BYTES] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+    def snapshot(self):
+        return dict(zip(self.FIELDS, self.values))
+
+def socket_queue_bytes(sock):
+    """Bytes waiting in sock's receive queue, from /proc/net/udp (0 elsewhere)."""
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    for table in ('/proc/net/udp', '/proc/net/udp6'):
         try:
-            data, addr = sock.recvfrom(2048)
+            with open(table) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 9 and fields[9] == inode:
+                        return int(fields[4].split(':')[1], 16)
+        except OSError:
+            pass
+    return 0
+
+class HealthCollector:
+    """Exports IngestHealth of each ingest loop, labelled by worker."""
+
+    def __init__(self):
+        self.loops = {}
+
+    def add(self, worker, health):
+        self.loops[str(worker)] = health
+
+    def collect(self):
+        snapshots = [(worker, h.snapshot()) for worker, h in self.loops.items()]
+        families = {
+            'packets': CounterMetricFamily("rtp_receiver_packets", "Datagrams ingested", labels=['worker']),
+            'kernel_drops': CounterMetricFamily("rtp_receiver_kernel_drops", "Datagrams dropped by the kernel on a full receive buffer (SO_RXQ_OVFL)", labels=['worker']),
+            'packet': SummaryMetricFamily("rtp_receiver_packet_processing_seconds", "Hot-loop time per ingested datagram", labels=['worker']),
+            'window': SummaryMetricFamily("rtp_receiver_window_processing_seconds", "Time to analyse and close a window", labels=['worker']),
+            'loop_lag': GaugeMetricFamily("rtp_receiver_loop_lag_seconds", "Lateness of the last scheduled window check", labels=['worker']),
+            'loop_lag_max': GaugeMetricFamily("rtp_receiver_loop_lag_max_seconds", "Largest lateness of a scheduled window check", labels=['worker']),
+            'queue_bytes': GaugeMetricFamily("rtp_receiver_socket_queue_bytes", "Bytes waiting in the socket receive queue at the last check", labels=['worker']),
+            'buffer_bytes': GaugeMetricFamily("rtp_receiver_socket_buffer_bytes", "Socket receive buffer size (SO_RCVBUF)", labels=['worker']),
+        }
+        for worker, h in snapshots:
+            families['packets'].add_metric([worker], h['packets'])
+            families['kernel_drops'].add_metric([worker], h['kernel_drops'])
+            families['packet'].add_metric([worker], h['packets'], h['ingest_seconds'])
+            families['window'].add_metric([worker], h['windows'], h['window_seconds'])
+            for key in ('loop_lag', 'loop_lag_max', 'queue_bytes', 'buffer_bytes'):
+                families[key].add_metric([worker], h[key])
+        yield from families.values()
+
+health_collector = HealthCollector()
+REGISTRY.register(health_collector)
+
+class HistoryRing:
+    """
+    Fixed-size, memory-mapped ring file of per-second, per-source records.
+
+    The file holds a header, a table of source names (one slot each), the
+    epoch second each ring row currently holds and a (seconds x slots)
+    array of (received, lost, jitter, delay) records. Second t lives in
+    row t % seconds, so writes and range queries are array slices of the
+    mapping, disk and memory use never grow, and a restarted receiver
+    picks up the history where it left off. When the name table is full
+    the least recently written source gives up its slot.
+    """
+
+    MAGIC = b'SPDH'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIII')  # magic, version, seconds, slots
+    NAME_SIZE = 64
+    RECORD = np.dtype([('received', '<u4'), ('lost', '<u4'), ('jitter', '<f4'), ('delay', '<f4')])
+    EMPTY = np.array((0, 0, np.nan, np.nan), dtype=RECORD)
+
+    def __init__(self, path, seconds=HISTORY_SECONDS, slots=HISTORY_SOURCES):
+        self.path = path
+        self.seconds = seconds
+        self.slots = slots
+        names_at = 64
+        stamps_at = names_at + slots * self.NAME_SIZE
+        last_at = stamps_at + 8 * seconds
+        records_at = last_at + 8 * slots
+        size = records_at + seconds * slots * self.RECORD.itemsize
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, seconds, slots)
+        fresh = not self._matches(path, header, size)
+        if fresh:
+            if os.path.exists(path):
+                print(f"[RECEIVER] {path} has a different layout, starting a new history")
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self.map = np.memmap(path, dtype=np.uint8, mode='r+', shape=(size,))
+        self.names = self.map[names_at:stamps_at].view(f'S{self.NAME_SIZE}')
+        self.stamps = self.map[stamps_at:last_at].view('<i8')
+        self.last = self.map[last_at:records_at].view('<i8')
+        self.records = self.map[records_at:].view(self.RECORD).reshape(seconds, slots)
+        if fresh:
+            self.stamps[:] = -1
+            self.last[:] = -1
+            self.records[:] = self.EMPTY
+            self.map[:self.HEADER.size] = np.frombuffer(header, dtype=np.uint8)
+            self.map.flush()
+        self.slot_of = {n.decode(errors='ignore'): i for i, n in enumerate(self.names) if n}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def _matches(cls, path, header, size):
+        try:
+            with open(path, 'rb') as f:
+                return os.fstat(f.fileno()).st_size == size and f.read(cls.HEADER.size) == header
+        except OSError:
+            return False
+
+    @classmethod
+    def _stored(cls, name):
+        """The name as stored in the file: cut to NAME_SIZE bytes on a character boundary."""
+        return name.encode()[:cls.NAME_SIZE].decode(errors='ignore')
+
+    def _slot(self, name):
+        name = self._stored(name)
+        slot = self.slot_of.get(name)
+        if slot is None:
+            free = np.flatnonzero(self.last < 0)
+            slot = int(free[0]) if len(free) else int(np.argmin(self.last))
+            old = self.names[slot]
+            if old:
+                del self.slot_of[old.decode(errors='ignore')]
+            self.names[slot] = name.encode()
+            self.records[:, slot] = self.EMPTY
+            self.slot_of[name] = slot
+        return slot
+
+    def write(self, name, seconds, received, lost, jitter, delay):
+        """Record one source's per-second figures, merging seconds already present."""
+        if not len(seconds):
+            return
+        with self.lock:
+            newest = max(int(seconds[-1]), int(self.stamps.max()))
+            keep = seconds > newest - self.seconds
+            seconds, received, lost, jitter, delay = (a[keep] for a in (seconds, received, lost, jitter, delay))
+            if not len(seconds):
+                return
+            slot = self._slot(name)
+            rows = seconds % self.seconds
+            stale = self.stamps[rows] != seconds
+            self.records[rows[stale]] = self.EMPTY
+            self.stamps[rows[stale]] = seconds[stale]
+            old = self.records[rows, slot]
+            # A second split across two windows is merged, averages weighted by packets.
+            before = old['received'].astype(np.float64)
+            total = before + received
+            with np.errstate(invalid='ignore', divide='ignore'):
+                merged_jitter = np.where(np.isnan(old['jitter']), jitter, np.where(np.isnan(jitter), old['jitter'],
+                                         (old['jitter'] * before + jitter * received) / total))
+                merged_delay = np.where(np.isnan(old['delay']), delay, np.where(np.isnan(delay), old['delay'],
+                                        (old['delay'] * before + delay * received) / total))
+            new = np.empty(len(rows), dtype=self.RECORD)
+            new['received'] = total
+            new['lost'] = old['lost'] + lost
+            new['jitter'] = merged_jitter
+            new['delay'] = merged_delay
+            self.records[rows, slot] = new
+            self.last[slot] = seconds.max()
+
+    def write_results(self, results):
+        for r in results:
+            self.write(series_name(r['source'], r['profile']), *r['history'])
+        self.map.flush()
+
+    def query(self, start, end, source=None):
+        """
+        Columnar slice of [start, end] (epoch seconds, clipped to what the
+        ring holds): {'seconds': [...], 'sources': {name: {field: [...]}}},
+        with null for seconds that have no data.
+        """
+        with self.lock:
+            newest = int(self.stamps.max())
+            start = max(int(start), newest - self.seconds + 1)
+            end = min(int(end), newest)
+            seconds = np.arange(start, end + 1, dtype=np.int64)
+            rows = seconds % self.seconds
+            present = self.stamps[rows] == seconds
+            names = [source] if source is not None else sorted(self.slot_of)
+            sources = {}
+            for name in names:
+                slot = self.slot_of.get(self._stored(name))
+                if slot is None:
+                    continue
+                block = self.records[rows, slot]
+                columns = {}
+                for field, column in (('received', 'received'), ('lost', 'lost'), ('jitter_ms', 'jitter'), ('delay_ms', 'delay')):
+                    columns[field] = [v if ok and v == v else None for v, ok in zip(block[column].tolist(), present.tolist())]
+                sources[name] = columns
+        return {'seconds': seconds.tolist(), 'sources': sources}
+
+history = None
+
+def serve_history(ring, port=HISTORY_PORT):
+    """
+    Serve GET /history?from=<epoch>&to=<epoch>[&source=<ip>[/<profile>]] (or last=<seconds>)
+    from the ring in a background thread.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path != '/history':
+                self.reply(404, {'error': 'not found'})
+                return
+            query = dict(urllib.parse.parse_qsl(url.query))
             now = time.time()
-            if len(data) < 12:
-                continue
-            ip = addr[0]
+            try:
+                end = float(query.get('to', now))
+                start = float(query['from']) if 'from' in query else end - float(query.get('last', 300))
+            except ValueError:
+                self.reply(400, {'error': 'from, to and last are epoch seconds'})
+                return
+            self.reply(200, ring.query(start, end, query.get('source')))
 
-            if ip not in buffers:
-                buffers[ip] = {
-                    'expected_seq': None,
-                    'received': 0,
-                    'lost': 0,
-                    'last_arrival': None,
-                    'jitter_list': [],
-                }
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
 
-            buf = buffers[ip]
-            seq = struct.unpack('!HHL', data[:8])[1]
+        def log_message(self, fmt, *args):
+            pass
 
-            if buf['expected_seq'] is not None:
-                expected = buf['expected_seq']
-                if seq != expected:
-                    buf['lost'] += (seq - expected) % 65536
+    server = ThreadingHTTPServer(('', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
 
-            buf['expected_seq'] = (seq + 1) % 65536
-            if buf['last_arrival'] is not None:
-                transit = now - buf['last_arrival']
-                jitter_ms = abs(transit - INTERVAL) * 1000
-                buf['jitter_list'].append(jitter_ms)
+def start_history():
+    """Open HISTORY_FILE and its query API, if history is enabled."""
+    global history
+    if not HISTORY_FILE:
+        return
+    history = HistoryRing(HISTORY_FILE)
+    serve_history(history)
+    print(f"[RECEIVER] Per-second history in {HISTORY_FILE} ({HISTORY_SECONDS} s), queries at :{HISTORY_PORT}/history")
 
-            buf['last_arrival'] = now
-            buf['received'] += 1
+def stream_profile(data):
+    """The profile name a sender tagged a packet with, or DEFAULT_PROFILE."""
+    end = PROBE_END + PROFILE_TAG.size
+    if len(data) < end or data[RTP_HEADER.size:RTP_HEADER.size + 4] != PROBE_MAGIC:
+        return DEFAULT_PROFILE
+    magic, n = PROFILE_TAG.unpack_from(data, PROBE_END)
+    if magic != PROFILE_MAGIC or len(data) < end + n:
+        return DEFAULT_PROFILE
+    return bytes(data[end:end + n]).decode(errors='replace')
 
-        except socket.timeout:
-            break
+def ingest_packet(store, data, addr, now):
+    """
+    Record one received RTP packet in its stream's row of the window store
+    (see PacketStore.stream_row()).
+    """
+    if len(data) < RTP_HEADER.size:
+        return
+    _, seq, ts, ssrc = RTP_HEADER.unpack_from(data)
+    delay = NO_DELAY
+    if len(data) >= PROBE_END:
+        magic, _, sent_ns = PROBE.unpack_from(data, RTP_HEADER.size)
+        if magic == PROBE_MAGIC:
+            delay = now - sent_ns * 1e-9
+    store.append(store.stream_row(addr, ssrc, data, now), now, seq, ts, ssrc, delay)
+
+def reflect_probe(sock, data, addr):
+    """Echo a sender's probe packet back to it so the sender can measure RTT."""
+    if len(data) < PROBE_END or data[RTP_HEADER.size:RTP_HEADER.size + 4] != PROBE_MAGIC:
+        return
+    data[RTP_HEADER.size:RTP_HEADER.size + 4] = ECHO_MAGIC
+    try:
+        sock.sendto(data, addr)
+    except OSError:
+        # A full send buffer or an unreachable peer loses this echo only.
+        pass
+
+class SourceNames:
+    """
+    Beacon names by IP from the destination list the senders use
+    (DESTINATIONS_URL, an http(s) URL or a local path), so results carry
+    a 'source' name instead of a bare address. Unknown addresses keep
+    their IP.
+    """
+
+    def __init__(self, source=DESTINATIONS_URL):
+        self.source = source
+        self.names = {}
+        self.windows = {}
+
+    def refresh(self):
+        try:
+            if self.source.startswith(('http://', 'https://')):
+                with urllib.request.urlopen(self.source, timeout=5) as response:
+                    data = json.load(response)
+            else:
+                path = self.source[len('file://'):] if self.source.startswith('file://') else self.source
+                with open(path) as f:
+                    data = json.load(f)
+            names = {str(e['ip']): str(e['name']) for e in data if isinstance(e, dict) and e.get('ip') and e.get('name')}
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[RECEIVER] Cannot load source names from {self.source}: {e}")
+            return
+        self.names = names
+
+    def watch(self, interval=REFRESH_INTERVAL):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.refresh()
+        threading.Thread(target=loop, name='source-names', daemon=True).start()
+
+    def label(self, results):
+        """
+        Set each result's 'source'. Streams of one profile arriving from
+        several ports of an address at once (beacons behind one NAT) are
+        told apart by appending the port, and several SSRCs on one port by
+        appending the SSRC as well. Streams count as concurrent when they
+        share a batch, when the store saw them active together (the
+        'port_shared' / 'ssrc_shared' flags of close_window()), or when
+        their last windows overlap, which also covers per-source windows
+        closing at different times and sources split across workers.
+        """
+        names = self.names
+        seen, ports = {}, {}
+        for r in results:
+            r['source'] = names.get(r['source_ip'], r['source_ip'])
+            seen[(r['source'], r['profile'])] = seen.get((r['source'], r['profile']), 0) + 1
+            port = (r['source'], r['source_port'], r['profile'])
+            ports[port] = ports.get(port, 0) + 1
+            windows = self.windows.setdefault((r['source_ip'], r['profile']), {})
+            windows[r['source_port']] = (r['window_start'], r['window_end'])
+        for r in results:
+            windows = self.windows[(r['source_ip'], r['profile'])]
+            for port, (start, end) in list(windows.items()):
+                if end < r['window_start'] - 2 * WINDOW_SECONDS:
+                    del windows[port]
+            overlap = any(port != r['source_port'] and start <= r['window_end'] and end >= r['window_start']
+                          for port, (start, end) in windows.items())
+            if ports[(r['source'], r['source_port'], r['profile'])] > 1 or r.get('ssrc_shared'):
+                r['source'] = f"{r['source']}:{r['source_port']}#{r['ssrc']:08x}"
+            elif seen[(r['source'], r['profile'])] > 1 or r.get('port_shared') or overlap:
+                r['source'] = f"{r['source']}:{r['source_port']}"
+
+source_names = SourceNames()
 
-    sock.close()
+def start_source_names():
+    """Load source names from DESTINATIONS_URL and keep them fresh."""
+    if not DESTINATIONS_URL:
+        return
+    source_names.refresh()
+    source_names.watch()
+    print(f"[RECEIVER] Naming sources from {DESTINATIONS_URL} ({len(source_names.names)} known)")
 
-    # Process results and export to Prometheus
-    for ip, buf in buffers.items():
-        total_packets = buf['received'] + buf['lost']
-        loss_pct = 100.0 * buf['lost'] / total_packets if total_packets else 0.0
-        jitter_avg = float(np.mean(buf['jitter_list'])) if buf['jitter_list'] else 0.0
-        mos_score = calculate_mos(loss_pct, jitter_avg)
+def series_name(source, profile):
+    """Name of a source's stream of one profile in logs and the history ring."""
+    return source if profile == DEFAULT_PROFILE else f"{source}/{profile}"
+
+def close_window(store, window_end=None, keys=None):
+    """
+    Summarise the window that just ended for the given sources (default:
+    every source seen) and reset their part of the store. Each result is
+    stamped with its window's start and end; without an explicit
+    window_end a source's window ends at its last packet.
+    """
+    results = []
+    for keys, totals, states, starts, arrival, ts, delay, seq, counts in store.drain(keys):
+        stats, sketches, history = analyze_window(arrival, ts, delay, seq, counts)
+        for i, (addr, ssrc) in enumerate(keys):
+            result = states[i].sequence.snapshot()
+            expected = result['expected']
+            loss_pct = 100.0 * result['lost'] / expected if expected else 0.0
+            jitter = states[i].jitter.jitter_ms()
+            end = window_end if window_end is not None else states[i].last_arrival
+            port_shared, ssrc_shared = store.sharing((addr, ssrc))
+            result.update(source_ip=addr[0], source_port=addr[1], ssrc=ssrc, profile=states[i].profile, window_start=starts[i],
+                          window_end=end, received=int(totals[i]), loss_pct=loss_pct, jitter_ms=jitter,
+                          port_shared=port_shared, ssrc_shared=ssrc_shared)
+            result.update((k, v[i].item()) for k, v in stats.items())
+            result.update((f'{k}_sketch', v[i]) for k, v in sketches.items())
+            result['history'] = history[i]
+            results.append(result)
+    if not results:
+        return []
+    score_window(results)
+    return results
+
+def score_window(results):
+    """
+    Effective loss (network loss plus jitter buffer discards), E-model R
+    and MOS for all of a window's results in one vectorized call. The
+    mouth-to-ear delay is the network delay chosen by MOS_DELAY plus the
+    playout buffer, one packet interval of the stream and the codec
+    look-ahead. The measured one-way delay is only used with
+    MOS_DELAY=one-way, as any skew between the hosts' clocks goes
+    straight into it.
+    """
+    expected = np.array([r['expected'] for r in results], dtype=np.float64)
+    lost = np.array([r['lost'] + r['late_discards'] for r in results], dtype=np.float64)
+    effective = np.where(expected > 0, 100.0 * np.minimum(lost, expected) / np.maximum(expected, 1), 0.0)
+    if MOS_DELAY == 'one-way':
+        delay = np.maximum(np.nan_to_num(np.array([r['delay_ms'] for r in results], dtype=np.float64)), 0.0)
+    else:
+        delay = np.full(len(results), 0.0 if MOS_DELAY == 'none' else MOS_DELAY)
+    delay += JITTER_BUFFER_MS + np.array([r['packet_interval_ms'] for r in results]) + CODECS[CODEC]['lookahead_ms']
+    r_factor = emodel_r(effective, delay, [r['burst_ratio'] for r in results])
+    mos = r_to_mos(r_factor)
+    for i, result in enumerate(results):
+        result['effective_loss_pct'] = effective[i].item()
+        result['r_factor'] = r_factor[i].item()
+        result['mos'] = mos[i].item()
+
+def publish_results(window_end, results):
+    """Hand one window's results to the Prometheus collector and log them."""
+    source_names.label(results)
+    collector.update(window_end, results)
+    if history is not None:
+        history.write_results(results)
+    if AGGREGATOR_URL:
+        push_summaries(encode_summaries(RECEIVER_NAME, window_end, results))
+    for r in results:
+        delay = f", Delay: {r['delay_ms']:.2f} ms" if r['delay_ms'] == r['delay_ms'] else ""
+        print(f"[RECEIVER] From {series_name(r['source'], r['profile'])} - Loss: {r['loss_pct']:.2f}%, Jitter: {r['jitter_ms']:.2f} ms "
+              f"(p99 {r['jitter_p99_ms']:.2f} ms), Dup: {r['duplicates']}, Reordered: {r['reordered']}{delay}, MOS: {r['mos']:.2f}")
+
+# Window summary pushed to the aggregator. A message is a header, the
+# destination (this receiver) name, then one record per stream: its source
+# and profile names, fixed fields and the non-empty jitter sketch buckets. Names are a length
+# byte plus UTF-8; several messages may be concatenated in one HTTP body.
+SUMMARY_MAGIC = b'SPAG'
+SUMMARY_VERSION = 2
+SUMMARY_HEADER = struct.Struct('!4sBdHH')     # magic, version, window end, sketch bins, records
+SUMMARY_RECORD = struct.Struct('!IIffffffH')  # received, lost, loss %, jitter, jitter sum, delay, delay p99, MOS, buckets
+SUMMARY_BUCKET = struct.Struct('!HI')         # sketch bucket index, count
+
+def _pack_name(name):
+    # Cut to 255 bytes on a character boundary so the name still decodes.
+    raw = name.encode()[:255].decode(errors='ignore').encode()
+    return bytes([len(raw)]) + raw
+
+def _summary_buckets(counts, limit):
+    """
+    A sketch's non-empty (bucket index, count) pairs, at most limit of
+    them: a sketch too wide for one message has runs of 2, 4, ...
+    neighbouring buckets merged into their middle one, trading accuracy
+    for size.
+    """
+    buckets = np.flatnonzero(counts)
+    weights = counts[buckets]
+    step = 1
+    while len(buckets) > max(limit, 1):
+        step *= 2
+        merged, inverse = np.unique(buckets // step, return_inverse=True)
+        weights = np.bincount(inverse, weights=weights)
+        buckets = np.minimum(merged * step + step // 2, SKETCH_BINS - 1)
+    return buckets, weights
 
-        packet_loss_metric.labels(source_ip=ip).set(loss_pct)
-        jitter_metric.labels(source_ip=ip).set(jitter_avg)
-        mos_metric.labels(source_ip=ip).set(mos_score)
+def encode_summaries(destination, window_end, results, mtu=SUMMARY_MTU):
+    """Pack a window's results into summary messages of at most mtu bytes each."""
+    head = _pack_name(destination)
+    records = []
+    for r in results:
+        sketch = r['jitter_sketch']
+        record = bytearray(_pack_name(r['source']) + _pack_name(r['profile']))
+        room = mtu - SUMMARY_HEADER.size - len(head) - len(record) - SUMMARY_RECORD.size
+        buckets, weights = _summary_buckets(sketch.counts, room // SUMMARY_BUCKET.size)
+        record += SUMMARY_RECORD.pack(r['received'], r['lost'], r['loss_pct'], r['jitter_ms'], sketch.sum,
+                                      r['delay_ms'], r['delay_p99_ms'], r['mos'], len(buckets))
+        for i, n in zip(buckets.tolist(), weights.tolist()):
+            record += SUMMARY_BUCKET.pack(i, min(int(n), 0xFFFFFFFF))
+        records.append(bytes(record))
+    messages, batch, size = [], [], SUMMARY_HEADER.size + len(head)
+    for record in records:
+        if batch and size + len(record) > mtu:
+            messages.append(_summary_message(window_end, head, batch))
+            batch, size = [], SUMMARY_HEADER.size + len(head)
+        batch.append(record)
+        size += len(record)
+    if batch:
+        messages.append(_summary_message(window_end, head, batch))
+    return messages
 
-        print(f"[RECEIVER] From {ip} - Loss: {loss_pct:.2f}%, Jitter: {jitter_avg:.2f} ms, MOS: {mos_score:.2f}")
+def _summary_message(window_end, head, records):
+    return SUMMARY_HEADER.pack(SUMMARY_MAGIC, SUMMARY_VERSION, window_end, SKETCH_BINS, len(records)) + head + b''.join(records)
 
-def run_test_loop():
+def decode_summaries(data):
     """
-    Starts Prometheus exporter and runs repeated tests every TEST_INTERVAL seconds.
+    Return (destination, window_end, record) for every stream record in
+    one or more concatenated summary messages. Records carry the fields of
+    SUMMARY_RECORD plus 'source', 'profile' and a QuantileSketch as
+    'jitter_sketch'. Raises ValueError on a malformed or incompatible
+    message, before any record is returned.
     """
-    start_http_server(8000)
-    print("[RECEIVER] Prometheus metrics exposed at :8000/metrics")
+    view, offset, decoded = memoryview(data), 0, []
+    try:
+        while offset < len(view):
+            magic, version, window_end, bins, count = SUMMARY_HEADER.unpack_from(view, offset)
+            if magic != SUMMARY_MAGIC or version != SUMMARY_VERSION:
+                raise ValueError("Not a SpiderMon window summary")
+            if bins != SKETCH_BINS:
+                raise ValueError(f"Sketch has {bins} buckets, expected {SKETCH_BINS} (SKETCH_ACCURACY differs)")
+            destination, offset = _unpack_name(view, offset + SUMMARY_HEADER.size)
+            for _ in range(count):
+                source, offset = _unpack_name(view, offset)
+                profile, offset = _unpack_name(view, offset)
+                fields = SUMMARY_RECORD.unpack_from(view, offset)
+                offset += SUMMARY_RECORD.size
+                counts = np.zeros(SKETCH_BINS, dtype=np.int64)
+                for _ in range(fields[-1]):
+                    i, n = SUMMARY_BUCKET.unpack_from(view, offset)
+                    counts[min(i, SKETCH_BINS - 1)] += n
+                    offset += SUMMARY_BUCKET.size
+                received, lost, loss_pct, jitter, jitter_sum, delay, delay_p99, mos, _ = fields
+                decoded.append((destination, window_end, {
+                    'source': source, 'profile': profile, 'received': received, 'lost': lost, 'loss_pct': loss_pct,
+                    'jitter_ms': jitter, 'delay_ms': delay, 'delay_p99_ms': delay_p99, 'mos': mos,
+                    'jitter_sketch': QuantileSketch(counts, jitter_sum),
+                }))
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Truncated window summary: {e}") from None
+    return decoded
 
+def _unpack_name(view, offset):
+    if offset >= len(view) or offset + 1 + view[offset] > len(view):
+        raise ValueError("Truncated window summary: name runs past the end")
+    n = view[offset]
+    return bytes(view[offset + 1:offset + 1 + n]).decode(), offset + 1 + n
+
+_summary_sock = None
+
+def push_summaries(messages, url=AGGREGATOR_URL):
+    """
+    Send summary messages to the aggregator: one datagram each over UDP, or
+    one POST in a background thread over HTTP so ingest never waits on it.
+    """
+    global _summary_sock
+    target = urllib.parse.urlsplit(url)
+    if target.scheme == 'udp':
+        if _summary_sock is None:
+            _summary_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for message in messages:
+            try:
+                _summary_sock.sendto(message, (target.hostname, target.port))
+            except OSError as e:
+                print(f"[RECEIVER] Could not push summary to {url}: {e}")
+                return
+    elif target.scheme in ('http', 'https'):
+        def post():
+            request = urllib.request.Request(url, data=b''.join(messages), method='POST',
+                                             headers={'Content-Type': 'application/octet-stream'})
+            try:
+                urllib.request.urlopen(request, timeout=10).close()
+            except OSError as e:
+                print(f"[RECEIVER] Could not push summary to {url}: {e}")
+        threading.Thread(target=post, daemon=True).start()
+    else:
+        print(f"[RECEIVER] Unsupported AGGREGATOR_URL {url}, expected udp:// or http://")
+
+def next_window_end(now, window=WINDOW_SECONDS):
+    """End of the wall-clock aligned window containing now."""
+    return (now // window + 1) * window
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IoVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+def _load_recvmmsg():
+    """libc recvmmsg(2) through ctypes, or None where it is not available."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+_recvmmsg = _load_recvmmsg()
+
+# SO_TIMESTAMPNS / SCM_TIMESTAMPNS share a value; Python does not export it.
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35) if sys.platform.startswith('linux') else None
+# Kernel count of datagrams dropped on the socket, sent as a uint32 cmsg.
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40) if sys.platform.startswith('linux') else None
+CMSG_HEADER = struct.Struct('@Nii')  # struct cmsghdr
+TIMESPEC = struct.Struct('@qq')      # struct timespec
+DROP_COUNT = struct.Struct('@I')     # SO_RXQ_OVFL payload
+CONTROL_SIZE = 64                    # Ancillary buffer per datagram
+
+class BatchReceiver:
+    """
+    Drains a non-blocking UDP socket into a preallocated buffer pool.
+
+    receive() waits for the socket to become readable and then pulls up to
+    RECV_BATCH datagrams: with one recvmmsg(2) call on Linux, otherwise with
+    recvmsg_into() until the socket would block. Packet i of the batch is
+    packet(i), a memoryview into the pool that is only valid until the next
+    receive().
+
+    With timestamps enabled the kernel stamps every datagram on arrival
+    (SO_TIMESTAMPNS) and stamps[i] holds that wire-arrival time; it is None
+    when the platform gives no stamp, and callers fall back to time.time().
+
+    Where SO_RXQ_OVFL is available, drops holds the kernel's running count
+    of datagrams it discarded because the socket buffer was full.
+    """
+
+    def __init__(self, sock, batch=RECV_BATCH, size=2048, use_recvmmsg=True, timestamps=KERNEL_TIMESTAMPS):
+        self.sock = sock
+        self.batch = batch
+        self.size = size
+        self.pool = bytearray(batch * size)
+        view = memoryview(self.pool)
+        self.slots = [view[i * size:(i + 1) * size] for i in range(batch)]
+        self.lengths = [0] * batch
+        self.addrs = [None] * batch
+        self.stamps = [None] * batch
+        self.timestamps = timestamps and self._enable_timestamps()
+        self.drops = 0
+        self.overflow = self._enable_overflow()
+        self.ancillary = self.timestamps or self.overflow
+        sock.setblocking(False)
+        self.mmsg = None
+        if use_recvmmsg and _recvmmsg is not None and sock.family == socket.AF_INET:
+            self._setup_mmsg()
+
+    def _enable_timestamps(self):
+        if SO_TIMESTAMPNS is None:
+            return False
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        except OSError as e:
+            print(f"[RECEIVER] Kernel timestamps unavailable ({e}), stamping in user space")
+            return False
+        return True
+
+    def _enable_overflow(self):
+        if SO_RXQ_OVFL is None:
+            return False
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        except OSError as e:
+            print(f"[RECEIVER] Socket drop counter unavailable ({e})")
+            return False
+        return True
+
+    def _setup_mmsg(self):
+        batch, size = self.batch, self.size
+        base = ctypes.addressof((ctypes.c_char * len(self.pool)).from_buffer(self.pool))
+        self.names = (ctypes.c_char * (16 * batch))()
+        # Each 16-byte sockaddr_in read as two native words: the first holds
+        # family, port and address, and is used as the address cache key.
+        self.names_view = memoryview(self.names).cast('B').cast('Q')
+        self.addr_cache = {}
+        self.iov = (_IoVec * batch)()
+        self.mmsg = (_MMsgHdr * batch)()
+        names_base = ctypes.addressof(self.names)
+        for i in range(batch):
+            self.iov[i].iov_base = base + i * size
+            self.iov[i].iov_len = size
+            hdr = self.mmsg[i].msg_hdr
+            hdr.msg_name = names_base + 16 * i
+            hdr.msg_iov = ctypes.pointer(self.iov[i])
+            hdr.msg_iovlen = 1
+            hdr.msg_namelen = 16
+        # msg_len is read straight from the raw array rather than through
+        # ctypes attribute access, which costs more than the parsing itself.
+        self.len_view = memoryview(self.mmsg).cast('B').cast('I')
+        self.len_index = _MMsgHdr.msg_len.offset // 4
+        self.len_stride = ctypes.sizeof(_MMsgHdr) // 4
+        self.dirty = 0
+        if self.ancillary:
+            self.control = (ctypes.c_char * (CONTROL_SIZE * batch))()
+            self.control_view = memoryview(self.control).cast('B')
+            control_base = ctypes.addressof(self.control)
+            for i in range(batch):
+                hdr = self.mmsg[i].msg_hdr
+                hdr.msg_control = control_base + CONTROL_SIZE * i
+                hdr.msg_controllen = CONTROL_SIZE
+            # The kernel shrinks msg_controllen to what it wrote, so it is
+            # restored before every call through this word view.
+            self.ctl_view = memoryview(self.mmsg).cast('B').cast('Q')
+            self.ctl_index = (_MMsgHdr.msg_hdr.offset + _MsgHdr.msg_controllen.offset) // 8
+            self.ctl_stride = ctypes.sizeof(_MMsgHdr) // 8
+
+    def receive(self, timeout):
+        """Wait up to timeout seconds; return the number of packets read."""
+        if not select.select([self.sock], [], [], timeout)[0]:
+            return 0
+        if self.mmsg is not None:
+            return self._receive_mmsg()
+        n = 0
+        if self.ancillary:
+            recvmsg_into, ancbufsize = self.sock.recvmsg_into, CONTROL_SIZE
+            while n < self.batch:
+                try:
+                    self.lengths[n], ancdata, _, self.addrs[n] = recvmsg_into([self.slots[n]], ancbufsize)
+                except (BlockingIOError, InterruptedError):
+                    break
+                self.stamps[n] = None
+                for level, kind, data in ancdata:
+                    if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                        sec, nsec = TIMESPEC.unpack_from(data)
+                        self.stamps[n] = sec + nsec * 1e-9
+                    elif level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL:
+                        self.drops = DROP_COUNT.unpack_from(data)[0]
+                n += 1
+            return n
+        recv_into = self.sock.recvfrom_into
+        while n < self.batch:
+            try:
+                self.lengths[n], self.addrs[n] = recv_into(self.slots[n])
+            except (BlockingIOError, InterruptedError):
+                break
+            n += 1
+        return n
+
+    def _receive_mmsg(self):
+        # msg_namelen is left at 16 by the kernel for AF_INET, so only
+        # msg_controllen of the slots used last time needs restoring.
+        if self.ancillary:
+            ctl, index, stride = self.ctl_view, self.ctl_index, self.ctl_stride
+            for i in range(self.dirty):
+                ctl[index + i * stride] = CONTROL_SIZE
+        n = _recvmmsg(self.sock.fileno(), self.mmsg, self.batch, 0, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise OSError(err, os.strerror(err))
+        names, cache = self.names_view, self.addr_cache
+        lens, index, stride = self.len_view, self.len_index, self.len_stride
+        for i in range(n):
+            self.lengths[i] = lens[index + i * stride]
+            raw = names[2 * i]
+            addr = cache.get(raw)
+            if addr is None:
+                if len(cache) > 65536:
+                    cache.clear()
+                packed = raw.to_bytes(8, sys.byteorder)
+                addr = cache[raw] = (socket.inet_ntoa(packed[4:8]), int.from_bytes(packed[2:4], 'big'))
+            self.addrs[i] = addr
+        if self.ancillary:
+            self.dirty = n
+            self._parse_control(n)
+        return n
+
+    def _parse_control(self, n):
+        """Pull SCM_TIMESTAMPNS and SO_RXQ_OVFL out of each slot's control messages."""
+        control, ctl = self.control_view, self.ctl_view
+        index, stride = self.ctl_index, self.ctl_stride
+        for i in range(n):
+            base = CONTROL_SIZE * i
+            end = base + ctl[index + i * stride]
+            self.stamps[i] = None
+            o = base
+            while o + CMSG_HEADER.size <= end:
+                length, level, kind = CMSG_HEADER.unpack_from(control, o)
+                if length < CMSG_HEADER.size:
+                    break
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                    sec, nsec = TIMESPEC.unpack_from(control, o + CMSG_HEADER.size)
+                    self.stamps[i] = sec + nsec * 1e-9
+                elif level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL:
+                    self.drops = DROP_COUNT.unpack_from(control, o + CMSG_HEADER.size)[0]
+                o += (length + 7) & ~7
+
+    def packet(self, i):
+        return self.slots[i][:self.lengths[i]]
+
+def open_rtp_socket(reuse_port=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if RECV_BUFFER:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        # Linux doubles the request for bookkeeping and caps it at net.core.rmem_max.
+        actual = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if actual < RECV_BUFFER:
+            print(f"[RECEIVER] Receive buffer capped at {actual} bytes, raise net.core.rmem_max for {RECV_BUFFER}")
+    if SEND_BUFFER:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        actual = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        if actual < SEND_BUFFER:
+            print(f"[RECEIVER] Send buffer capped at {actual} bytes, raise net.core.wmem_max for {SEND_BUFFER}")
+    sock.bind(('', PORT))
+    return sock
+
+def close_due(store, now, window_end):
+    """
+    Close the windows due at now, window_end being the scheduled check.
+    Returns (stamp, results, next_check); results is None when no window
+    closed.
+
+    With RECEIVER_WINDOWS=aligned every source shares wall-clock aligned
+    windows. With RECEIVER_WINDOWS=per-source each source's window opens
+    with its first packet and closes after WINDOW_SECONDS or when the
+    source goes quiet, so staggered senders are never cut mid-test.
+    """
+    if RECEIVER_WINDOWS == 'per-source':
+        full, idle = store.due(now)
+        results = close_window(store, now, full) + close_window(store, None, idle)
+        for key in idle:
+            store.release(key)
+        store.expire(now)
+        return now, results or None, now + min(STREAM_TIMEOUT / 2, 0.5)
+    return window_end, close_window(store, window_end), next_window_end(now)
+
+def first_window_check(now):
+    """When close_due should first run after ingest starts."""
+    return now if RECEIVER_WINDOWS == 'per-source' else next_window_end(now)
+
+def ingest_batch(sock, store, rx, n):
+    """Feed the n datagrams of the last receive into the window store."""
+    now = time.time()
+    stamps = rx.stamps
+    for i in range(n):
+        packet = rx.packet(i)
+        ingest_packet(store, packet, rx.addrs[i], stamps[i] or now)
+        if REFLECT:
+            reflect_probe(sock, packet, rx.addrs[i])
+
+def ingest_loop(sock, on_window, health=None):
+    """
+    Ingest from sock forever, handing each batch of closed windows to
+    on_window(stamp, results) and recording the loop's own cost in health.
+    """
+    store = PacketStore()
+    rx = BatchReceiver(sock)
+    health = health or IngestHealth()
+    window_end = first_window_check(time.time())
     while True:
-        # align to next full minute
-        now = datetime.now(timezone.utc)
-        next_run = (now + timedelta(minutes=1)).replace(second=0, microsecond=0)
-        wait_until(next_run)
+        now = time.time()
+        remaining = window_end - now
+        if remaining <= 0:
+            health.record_check(-remaining, sock)
+            started = time.perf_counter()
+            stamp, results, window_end = close_due(store, now, window_end)
+            if results is not None:
+                health.record_window(time.perf_counter() - started)
+                on_window(stamp, results)
+            continue
+        n = rx.receive(remaining)
+        if n:
+            started = time.perf_counter()
+            ingest_batch(sock, store, rx, n)
+            health.record_batch(n, time.perf_counter() - started, rx.drops)
+
+def publish_window(window_end, results):
+    end_ts = datetime.fromtimestamp(window_end, timezone.utc).isoformat()
+    print(f"[RECEIVER] Window ending {end_ts} closed")
+    publish_results(window_end, results)
+
+def worker_main(worker, queue, health):
+    """Worker process: one SO_REUSEPORT socket, windows shipped to the parent."""
+    sock = open_rtp_socket(reuse_port=True)
+    print(f"[RECEIVER] Worker {worker} (pid {os.getpid()}) listening on UDP {PORT}")
+    try:
+        ingest_loop(sock, lambda window_end, results: queue.put((window_end, worker, results)), health)
+    finally:
+        sock.close()
+
+def run_workers(workers):
+    """
+    Spread ingest over several processes bound to the same port with
+    SO_REUSEPORT; the kernel hashes each source to one worker, so the
+    parent merges windows by simply publishing every worker's results.
+    """
+    queue = multiprocessing.Queue()
+    healths = [IngestHealth() for _ in range(workers)]
+    for i, health in enumerate(healths):
+        health_collector.add(i, health)
+    procs = [multiprocessing.Process(target=worker_main, args=(i, queue, healths[i]), daemon=True) for i in range(workers)]
+    for p in procs:
+        p.start()
+    pending = {}
+    try:
+        while True:
+            window_end, worker, results = queue.get()
+            if RECEIVER_WINDOWS == 'per-source':
+                # Per-source windows close independently; nothing to line up.
+                publish_window(window_end, results)
+                continue
+            merged = pending.setdefault(window_end, {})
+            merged[worker] = results
+            if len(merged) == workers:
+                del pending[window_end]
+                publish_window(window_end, [r for w in sorted(merged) for r in merged[w]])
+            # A worker that missed a window must not hold older ones back.
+            for stale in [w for w in pending if w < window_end]:
+                merged = pending.pop(stale)
+                publish_window(stale, [r for w in sorted(merged) for r in merged[w]])
+    finally:
+        for p in procs:
+            p.terminate()
+
+def run_receiver():
+    """
+    Bind the RTP port once and ingest continuously, publishing per-source
+    stats every time a WINDOW_SECONDS window closes.
+    """
+    start_http_server(METRICS_PORT)
+    print(f"[RECEIVER] Prometheus metrics exposed at :{METRICS_PORT}/metrics")
+    start_history()
+    start_source_names()
+    print(f"[RECEIVER] Listening on UDP {PORT}, {WINDOW_SECONDS:g} s windows")
 
-        receive_rtp_once()
+    if RECEIVER_WORKERS > 1:
+        run_workers(RECEIVER_WORKERS)
+        return
 
-        remaining = TEST_INTERVAL - DURATION
-        if remaining > 0:
-            print(f"[RECEIVER] Sleeping {remaining:.2f} seconds until next test cycle...")
-            time.sleep(remaining)
+    sock = open_rtp_socket()
+    health = IngestHealth()
+    health_collector.add(0, health)
+    try:
+        ingest_loop(sock, publish_window, health)
+    finally:
+        sock.close()
 
 if __name__ == "__main__":
     print("[RECEIVER] Receiver started and running continuously.")
-    run_test_loop()
+    run_receiver()
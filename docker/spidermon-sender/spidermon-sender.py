@@ -2,12 +2,40 @@ import socket
 import time
 import random
 import struct
-import threading
+import heapq
+import itertools
+import math
 import os
+import queue
+import select
+import threading
+import ipaddress
 import json
+import argparse
+import hashlib
 import requests
 from datetime import datetime, timedelta, timezone
 
+# Configuration (each value can be overridden through the environment)
+DESTINATIONS_URL = os.environ.get("DESTINATIONS_URL", "https://raw.githubusercontent.com/ferdaze/Spider-Mon/refs/heads/main/destinations.json")
+CACHE_FILE = os.environ.get("CACHE_FILE", "cached_destinations.json")
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", 300))  # seconds between conditional destination fetches
+INTERVAL = float(os.environ.get("INTERVAL", 0.02))  # 20 ms
+DURATION = float(os.environ.get("DURATION", 45))  # seconds
+RATE = int(os.environ.get("RATE", 8000))  # RTP timestamp rate for audio
+PAYLOAD_TYPE = int(os.environ.get("PAYLOAD_TYPE", 0))
+PAYLOAD_SIZE = int(os.environ.get("PAYLOAD_SIZE", 160))  # bytes, 20 ms of G.711
+PAYLOAD_MODE = os.environ.get("PAYLOAD_MODE", "pool")  # static, pool or codec
+PAYLOAD_POOL_FRAMES = int(os.environ.get("PAYLOAD_POOL_FRAMES", 256))
+ECHO_GRACE = float(os.environ.get("ECHO_GRACE", 1))  # seconds to wait for reflected probes after the last send
+START_DELAY_SECONDS = int(os.environ.get("START_DELAY_SECONDS", 61))  # Start 1 second after receiver
+CYCLE_SECONDS = int(os.environ.get("CYCLE_SECONDS", 60))  # Period between tests in service mode
+SENDER_MODE = os.environ.get("SENDER_MODE", "once")  # once (cron) or service
+SCHEDULE_MODE = os.environ.get("SCHEDULE_MODE", "aligned")  # aligned or staggered start per destination
+STAGGER_SPREAD = float(os.environ.get("STAGGER_SPREAD", max(CYCLE_SECONDS - DURATION - 1, 0)))  # seconds
+BEACON_NAME = os.environ.get("BEACON_NAME", socket.gethostname())  # this sender's name in the mesh
+DSCP = int(os.environ.get("DSCP", 0))  # DSCP class of the default stream profile
+
 def get_own_ip():
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
@@ -16,35 +44,203 @@ def get_own_ip():
     except:
         return "127.0.0.1"
 
-def is_cache_valid(filepath, ttl):
-    if not os.path.exists(filepath):
-        return False
-    age = time.time() - os.path.getmtime(filepath)
-    return age < ttl
+# Stream profiles a destination can list by name in destinations.json.
+# "default" is the stream every destination gets when it lists none.
+PROFILES = {
+    "default":     {"payload_size": PAYLOAD_SIZE, "interval": INTERVAL, "payload_type": PAYLOAD_TYPE, "dscp": DSCP},
+    "voice":       {"payload_size": 160, "interval": 0.02, "payload_type": 0, "dscp": 46},    # G.711, EF
+    "video":       {"payload_size": 1200, "interval": 0.005, "payload_type": 96, "dscp": 34}, # ~2 Mbit/s, AF41
+    "signaling":   {"payload_size": 400, "interval": 0.1, "payload_type": 97, "dscp": 24},    # CS3
+    "best-effort": {"payload_size": 1000, "interval": 0.01, "payload_type": 98, "dscp": 0},
+}
+MAX_PAYLOAD = 1472 - 12  # Largest RTP payload in one unfragmented IPv4 datagram
 
-def fetch_destinations():
-    if is_cache_valid(CACHE_FILE, CACHE_TTL):
-        try:
-            with open(CACHE_FILE, "r") as f:
-                return json.load(f)
-        except Exception:
-            print("[SENDER] Cached file is invalid. Removing...")
-            os.remove(CACHE_FILE)
+def validate_profile(item):
+    """
+    Resolve one "profiles" item, a profile name or an object with a "name"
+    and any fields overriding that profile (or "default"), into a complete
+    profile; return None if it is unusable.
+    """
+    if isinstance(item, str):
+        item = {"name": item}
+        if item["name"] not in PROFILES:
+            return None
+    if not isinstance(item, dict) or not item.get("name"):
+        return None
+    name = str(item["name"])
+    base = PROFILES.get(name, PROFILES["default"])
+    try:
+        profile = {
+            "name": name,
+            "payload_size": int(item.get("payload_size", base["payload_size"])),
+            "interval": float(item.get("interval", base["interval"])),
+            "payload_type": int(item.get("payload_type", base["payload_type"])),
+            "dscp": int(item.get("dscp", base["dscp"])),
+        }
+    except (ValueError, TypeError, OverflowError):
+        # OverflowError: JSON allows Infinity and 1e400, which int() refuses.
+        return None
+    if (len(name.encode()) > 32 or not PROBE.size + PROFILE_TAG.size + len(name.encode()) <= profile["payload_size"] <= MAX_PAYLOAD
+            or not math.isfinite(profile["interval"]) or not profile["interval"] >= 0.001 or not 0 <= profile["payload_type"] < 128 or not 0 <= profile["dscp"] < 64):
+        return None
+    # The RTP timestamp advances by RATE * interval per packet; a fraction
+    # would be dropped every packet and the receiver's jitter would drift.
+    ticks = RATE * profile["interval"]
+    if abs(ticks - round(ticks)) > 1e-6:
+        return None
+    return profile
 
+def validate_destination(entry):
+    """
+    Return a clean {"name", "ip", "port", "profiles"} entry, or None if it
+    is unusable. Broadcast, unspecified and multicast addresses are not
+    unicast peers and are rejected.
+    """
+    if not isinstance(entry, dict):
+        return None
     try:
-        print(f"[SENDER] Fetching destinations from {DESTINATIONS_URL}")
-        response = requests.get(DESTINATIONS_URL, timeout=5)
+        address = ipaddress.IPv4Address(entry.get("ip"))
+        port = int(entry.get("port", 5004))
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if not 0 < port < 65536 or address.is_multicast or address.is_unspecified or address == ipaddress.IPv4Address("255.255.255.255"):
+        return None
+    ip = str(address)
+    items = entry.get("profiles") or ["default"]
+    if not isinstance(items, list):
+        return None
+    profiles = [validate_profile(item) for item in items]
+    if None in profiles or len({p["name"] for p in profiles}) != len(profiles):
+        return None
+    return {"name": str(entry.get("name") or f"{ip}:{port}"), "ip": ip, "port": port, "profiles": profiles}
+
+class DestinationRegistry:
+    """
+    In-memory destination list kept in sync with DESTINATIONS_URL.
+
+    refresh() is conditional: over HTTP it sends the last ETag and
+    Last-Modified back as If-None-Match / If-Modified-Since, and for a local
+    file (a plain path or file:// URL) it checks the file's mtime and size.
+    Entries are validated and diffed against the current list; each change
+    is queued on `changes` as ("added" | "removed", entry) so a running
+    sender can apply it without touching its other streams. The last good
+    list is cached in CACHE_FILE for start-up and for when the source is down.
+    """
+
+    def __init__(self, source=DESTINATIONS_URL, cache_file=CACHE_FILE, own_ip=None):
+        self.source = source
+        self.cache_file = cache_file
+        self.own_ip = own_ip
+        self.entries = {}
+        self.validators = {}
+        self.changes = queue.SimpleQueue()
+        self.lock = threading.Lock()
+
+    def targets(self):
+        with self.lock:
+            return [e for e in self.entries.values() if e["ip"] != self.own_ip]
+
+    def load(self):
+        """Start from the cache, then refresh; fail only if neither yields a list."""
+        try:
+            with open(self.cache_file, "r") as f:
+                cached = json.load(f)
+            self.validators = cached.get("validators", {}) if isinstance(cached, dict) else {}
+            self._apply(cached["destinations"] if isinstance(cached, dict) else cached, quiet=True)
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            print(f"[SENDER] Cached file is invalid ({e}). Ignoring it.")
+            self.validators = {}
+        self.refresh()
+        if not self.entries:
+            raise RuntimeError("Cannot load destinations.")
+
+    def refresh(self):
+        """Fetch the source if it changed; return (added, removed)."""
+        try:
+            fetched = self._fetch()
+        except Exception as e:
+            print(f"[SENDER] Failed to fetch destinations: {e}")
+            return [], []
+        if fetched is None:
+            return [], []
+        data, validators = fetched
+        try:
+            added, removed = self._apply(data)
+        except ValueError as e:
+            # Validators are only kept for a list that was applied, so a bad
+            # one is fetched again once fixed at the source.
+            print(f"[SENDER] Ignoring invalid destination list: {e}")
+            return [], []
+        self.validators = validators
+        try:
+            with open(self.cache_file, "w") as f:
+                json.dump({"validators": self.validators, "destinations": list(self.entries.values())}, f, indent=2)
+        except OSError as e:
+            print(f"[SENDER] Cannot write {self.cache_file}: {e}")
+        return added, removed
+
+    def _fetch(self):
+        """
+        Return (parsed destination list, validators to keep once it is
+        applied), or None when it has not changed.
+        """
+        if not self.source.startswith(("http://", "https://")):
+            path = self.source[len("file://"):] if self.source.startswith("file://") else self.source
+            st = os.stat(path)
+            stamp = f"{st.st_mtime_ns}:{st.st_size}"
+            if self.validators.get("file") == stamp:
+                return None
+            with open(path, "r") as f:
+                data = json.load(f)
+            return data, {"file": stamp}
+
+        headers = {}
+        if self.validators.get("etag"):
+            headers["If-None-Match"] = self.validators["etag"]
+        if self.validators.get("last_modified"):
+            headers["If-Modified-Since"] = self.validators["last_modified"]
+        response = requests.get(self.source, headers=headers, timeout=5)
+        if response.status_code == 304:
+            return None
         response.raise_for_status()
         data = response.json()
-        with open(CACHE_FILE, "w") as f:
-            json.dump(data, f, indent=2)
-        return data
-    except Exception as e:
-        print(f"[SENDER] Failed to fetch destinations: {e}")
-        if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, "r") as f:
-                return json.load(f)
-        raise RuntimeError("Cannot load destinations.")
+        return data, {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+    def _apply(self, data, quiet=False):
+        if not isinstance(data, list):
+            raise ValueError("destination list must be a JSON array")
+        fresh = {}
+        for entry in data:
+            clean = validate_destination(entry)
+            if clean is None:
+                print(f"[SENDER] Skipping invalid destination entry: {entry!r}")
+                continue
+            fresh[(clean["ip"], clean["port"])] = clean
+        with self.lock:
+            added = [e for k, e in fresh.items() if k not in self.entries]
+            removed = [e for k, e in self.entries.items() if k not in fresh]
+            self.entries = fresh
+        if not quiet:
+            for entry in added:
+                print(f"[SENDER] Destination added: {entry['name']} ({entry['ip']}:{entry['port']})")
+                self.changes.put(("added", entry))
+            for entry in removed:
+                print(f"[SENDER] Destination removed: {entry['name']} ({entry['ip']}:{entry['port']})")
+                self.changes.put(("removed", entry))
+        return added, removed
+
+    def watch(self, interval=REFRESH_INTERVAL):
+        """Refresh every interval seconds from a background thread."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.refresh()
+        threading.Thread(target=loop, name="destination-refresh", daemon=True).start()
 
 def wait_until(target_time):
     now = datetime.now(timezone.utc)
@@ -53,30 +249,411 @@ def wait_until(target_time):
         print(f"[SENDER] Sleeping for {delay:.2f} seconds...")
         time.sleep(delay)
 
-def create_rtp_packet(seq, timestamp):
+def create_rtp_packet(seq, timestamp, ssrc=12345):
     version = 2
     header = (version << 14) | PAYLOAD_TYPE
     rtp_header = struct.pack("!HHL", header, seq, timestamp)
-    ssrc = struct.pack("!L", SSRC)
+    ssrc = struct.pack("!L", ssrc)
     payload = bytes([random.randint(0, 255)] * 160)
     return rtp_header + ssrc + payload
 
-def send_stream(sock, target):
-    ip, port = target["ip"], target["port"]
-    name = target.get("name", f"{ip}:{port}")
-    print(f"[SENDER] Sending to {name} ({ip}:{port})")
-    seq = 0
-    timestamp = 0
-    start_time = time.time()
-    while time.time() - start_time < DURATION:
-        pkt = create_rtp_packet(seq, timestamp)
-        sock.sendto(pkt, (ip, port))
-        seq = (seq + 1) % 65536
-        timestamp += int(RATE * INTERVAL)
-        time.sleep(INTERVAL)
-    print(f"[SENDER] Finished sending to {name}")
-
-def main():
+RTP_HEADER = struct.Struct("!HHLL")
+
+class StaticPayload:
+    """Constant payload written once into the template and never touched again."""
+
+    def __init__(self, size=PAYLOAD_SIZE, fill=0xFF):
+        self.size = size
+        self.initial = bytes([fill]) * size
+
+    def fill(self, buf, offset, index):
+        pass
+
+class RandomPoolPayload:
+    """Cycles through a pool of frames generated once at start-up."""
+
+    def __init__(self, size=PAYLOAD_SIZE, frames=PAYLOAD_POOL_FRAMES):
+        self.size = size
+        self.frames = frames
+        pool = memoryview(self.generate(size * frames))
+        self.pool = [pool[i * size:(i + 1) * size] for i in range(frames)]
+        self.initial = bytes(self.pool[0])
+
+    def generate(self, nbytes):
+        return os.urandom(nbytes)
+
+    def fill(self, buf, offset, index):
+        buf[offset:] = self.pool[index % self.frames]
+
+def linear_to_ulaw(sample):
+    """Encode a 16-bit linear PCM sample as G.711 mu-law."""
+    sign = 0x80 if sample < 0 else 0
+    magnitude = min(abs(sample), 32635) + 132
+    exponent = 7
+    while exponent > 0 and not magnitude & (0x4000 >> (7 - exponent)):
+        exponent -= 1
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return ~(sign | (exponent << 4) | mantissa) & 0xFF
+
+class CodecPayload(RandomPoolPayload):
+    """Pool of G.711 mu-law frames carrying a tone with noise, shaped like speech."""
+
+    def __init__(self, size=PAYLOAD_SIZE, frames=PAYLOAD_POOL_FRAMES, tone_hz=440, level=4000):
+        self.tone_hz = tone_hz
+        self.level = level
+        super().__init__(size, frames)
+
+    def generate(self, nbytes):
+        step = 2 * math.pi * self.tone_hz / RATE
+        return bytes(
+            linear_to_ulaw(int(self.level * math.sin(step * n) + random.gauss(0, self.level / 8)))
+            for n in range(nbytes)
+        )
+
+PAYLOADS = {
+    "static": StaticPayload,
+    "pool": RandomPoolPayload,
+    "codec": CodecPayload,
+}
+
+_payloads = {}
+
+def shared_payload(size, mode=PAYLOAD_MODE):
+    """
+    One payload generator per (mode, size), shared by every stream: fill()
+    only reads the pool, so streams of the same size need not each
+    generate their own.
+    """
+    payload = _payloads.get((mode, size))
+    if payload is None:
+        payload = _payloads[(mode, size)] = PAYLOADS[mode](size)
+    return payload
+
+# Probe block at the start of every payload: magic, stream ID and send time
+# in ns since the epoch. A reflecting receiver echoes it back as ECHO_MAGIC.
+PROBE = struct.Struct("!4sLQ")
+PROBE_MAGIC = b"SPDM"
+ECHO_MAGIC = b"SPDE"
+# Profile tag right after the probe: magic and name length, then the name,
+# so the receiver can report each stream under its profile.
+PROFILE_TAG = struct.Struct("!4sB")
+PROFILE_MAGIC = b"SPCL"
+
+class PacketFactory:
+    """
+    Builds RTP packets by patching a preallocated template in place.
+
+    build() returns the same bytearray on every call, so the packet must be
+    sent before the next call. Without an explicit ssrc each factory draws a
+    random one (RFC 3550 section 8), so every stream is told apart by the
+    receiver. When a stream_id is given, the first bytes of the payload
+    carry a probe block with the send time for delay and RTT.
+    """
+
+    def __init__(self, ssrc=None, payload_type=PAYLOAD_TYPE, payload=None, stream_id=None, profile=None):
+        self.payload = payload if payload is not None else PAYLOADS[PAYLOAD_MODE]()
+        self.tag = b""
+        if profile is not None:
+            name = profile.encode()
+            self.tag = PROFILE_TAG.pack(PROFILE_MAGIC, len(name)) + name
+        if stream_id is not None and self.payload.size < PROBE.size + len(self.tag):
+            raise ValueError(f"Payload of {self.payload.size} bytes cannot carry the {PROBE.size + len(self.tag)}-byte probe")
+        self.stream_id = stream_id
+        self.first = (2 << 14) | payload_type
+        if ssrc is None:
+            ssrc = random.getrandbits(32)
+        self.ssrc = ssrc
+        self.buf = bytearray(RTP_HEADER.size + self.payload.size)
+        self.buf[RTP_HEADER.size:] = self.payload.initial
+        RTP_HEADER.pack_into(self.buf, 0, self.first, 0, 0, ssrc)
+        # Header, probe and profile tag go out in a single pack per packet.
+        self.head = struct.Struct(RTP_HEADER.format + PROBE.format[1:] + f"{len(self.tag)}s")
+
+    def build(self, seq, timestamp):
+        self.payload.fill(self.buf, RTP_HEADER.size, seq)
+        if self.stream_id is None:
+            RTP_HEADER.pack_into(self.buf, 0, self.first, seq, timestamp, self.ssrc)
+        else:
+            self.head.pack_into(self.buf, 0, self.first, seq, timestamp, self.ssrc,
+                                PROBE_MAGIC, self.stream_id, time.time_ns(), self.tag)
+        return self.buf
+
+class RtpStream:
+    """
+    One paced RTP stream towards a single destination, shaped by a profile
+    (payload size, interval, payload type and DSCP; see PROFILES).
+
+    The stream never sleeps on its own; the scheduler calls fire() when the
+    stream's absolute deadline is reached and fire() returns the next one.
+    A DSCP other than 0 is set per packet as IP_TOS ancillary data, so
+    streams of every class share one socket. A send that fails (no route,
+    a full send buffer, a refused address) is counted in send_errors rather
+    than in sent, and the stream keeps its pace, so one bad destination
+    never stops the rest.
+    """
+
+    def __init__(self, sock, target, start, duration=DURATION, interval=None, factory=None, profile=None, ssrc=None):
+        profile = profile if profile is not None else PROFILES["default"]
+        self.sock = sock
+        self.stream_id = random.getrandbits(32)
+        self.profile = profile.get("name", "default")
+        self.factory = factory if factory is not None else PacketFactory(
+            ssrc=ssrc, payload_type=profile["payload_type"], payload=shared_payload(profile["payload_size"]),
+            stream_id=self.stream_id, profile=self.profile)
+        self.ip, self.port = target["ip"], target["port"]
+        self.addr = (self.ip, self.port)
+        self.name = target.get("name", f"{self.ip}:{self.port}")
+        self.interval = interval if interval is not None else profile["interval"]
+        self.ts_step = round(RATE * self.interval)
+        self.ancillary = [(socket.IPPROTO_IP, socket.IP_TOS, struct.pack("i", profile["dscp"] << 2))] if profile["dscp"] else None
+        self.start = start
+        self.count = int(round(duration / self.interval))
+        self.seq = 0
+        self.timestamp = 0
+        self.stopped = False
+        self.attempts = 0
+        self.sent = 0
+        self.send_errors = 0
+        self.last_error = None
+        self.late_sum = 0.0
+        self.late_max = 0.0
+        self.echoes = 0
+        self.rtt_sum = 0.0
+        self.rtt_min = None
+        self.rtt_max = 0.0
+
+    def fire(self, deadline, clock):
+        """
+        Send one packet and return the next deadline, or None when done.
+        Lateness is read from clock() right before the send, so time spent
+        on earlier streams of the same batch is included.
+        """
+        if self.stopped:
+            return None
+        pkt = self.factory.build(self.seq, self.timestamp)
+        now = clock()
+        try:
+            if self.ancillary is None:
+                self.sock.sendto(pkt, self.addr)
+            else:
+                self.sock.sendmsg([pkt], self.ancillary, 0, self.addr)
+            self.sent += 1
+        except OSError as e:
+            self.send_errors += 1
+            self.last_error = e
+        late = now - deadline
+        self.late_sum += late
+        if late > self.late_max:
+            self.late_max = late
+        attempts = self.attempts = self.attempts + 1
+        self.seq = (self.seq + 1) & 0xFFFF
+        self.timestamp = (self.timestamp + self.ts_step) & 0xFFFFFFFF
+        # Deadlines are computed from the stream start, not from "now", so
+        # time spent sending never accumulates into drift.
+        if attempts >= self.count:
+            return None
+        return self.start + attempts * self.interval
+
+    def record_rtt(self, rtt):
+        self.echoes += 1
+        self.rtt_sum += rtt
+        if self.rtt_min is None or rtt < self.rtt_min:
+            self.rtt_min = rtt
+        if rtt > self.rtt_max:
+            self.rtt_max = rtt
+
+    def report(self):
+        mean_ms = 1000 * self.late_sum / self.attempts if self.attempts else 0.0
+        return {
+            "name": self.name,
+            "profile": self.profile,
+            "sent": self.sent,
+            "send_errors": self.send_errors,
+            "deadline_error_mean_ms": mean_ms,
+            "deadline_error_max_ms": 1000 * self.late_max,
+            "echoes": self.echoes,
+            "rtt_mean_ms": 1000 * self.rtt_sum / self.echoes if self.echoes else None,
+            "rtt_min_ms": 1000 * self.rtt_min if self.echoes else None,
+            "rtt_max_ms": 1000 * self.rtt_max if self.echoes else None,
+        }
+
+class DeadlineScheduler:
+    """
+    Single-threaded pacing engine: a heap of streams keyed on next send time.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._order = itertools.count()
+
+    def add(self, stream, deadline):
+        heapq.heappush(self._heap, (deadline, next(self._order), stream))
+
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self, now):
+        """Fire every stream whose deadline has passed; return finished streams."""
+        finished = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, order, stream = heap[0]
+            nxt = stream.fire(deadline, self.clock)
+            if nxt is None:
+                heapq.heappop(heap)
+                finished.append(stream)
+            else:
+                heapq.heapreplace(heap, (nxt, order, stream))
+        return finished
+
+    def run(self, on_finish=None, idle=time.sleep):
+        """
+        Block until every stream has finished sending. Time until the next
+        deadline is handed to idle(), which may return early.
+        """
+        while self._heap:
+            delay = self._heap[0][0] - self.clock()
+            if delay > 0:
+                idle(delay)
+            for stream in self.run_due(self.clock()):
+                if on_finish:
+                    on_finish(stream)
+
+def profile_suffix(report):
+    return "" if report["profile"] == "default" else f" [{report['profile']}]"
+
+def log_stream_report(stream):
+    r = stream.report()
+    print(f"[SENDER] Finished sending to {r['name']}{profile_suffix(r)} - Packets: {r['sent']}, "
+          f"Deadline error avg: {r['deadline_error_mean_ms']:.3f} ms, max: {r['deadline_error_max_ms']:.3f} ms")
+    if stream.send_errors:
+        print(f"[SENDER] {stream.send_errors} sends to {r['name']}{profile_suffix(r)} failed, last: {stream.last_error}")
+
+def collect_echoes(sock, streams, timeout):
+    """
+    Wait up to timeout seconds for probes reflected by receivers and record
+    their round-trip time against the stream that sent them.
+    """
+    if not select.select([sock], [], [], timeout)[0]:
+        return
+    while True:
+        try:
+            data = sock.recv(2048, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionRefusedError:
+            continue
+        record_echo(streams, data, time.time_ns())
+
+def record_echo(streams, data, now_ns):
+    """
+    Credit a reflected probe to the stream that sent it. Returns False when
+    data is not an echo.
+    """
+    if len(data) < RTP_HEADER.size + PROBE.size:
+        return False
+    magic, stream_id, sent_ns = PROBE.unpack_from(data, RTP_HEADER.size)
+    if magic != ECHO_MAGIC:
+        return False
+    stream = streams.get(stream_id)
+    if stream is not None:
+        stream.record_rtt((now_ns - sent_ns) / 1e9)
+    return True
+
+def log_rtt_report(stream):
+    r = stream.report()
+    if r["echoes"]:
+        print(f"[SENDER] RTT to {r['name']}{profile_suffix(r)} - Echoes: {r['echoes']}/{r['sent']}, "
+              f"avg: {r['rtt_mean_ms']:.3f} ms, min: {r['rtt_min_ms']:.3f} ms, max: {r['rtt_max_ms']:.3f} ms")
+
+def apply_destination_changes(registry, scheduler, sock, streams, end):
+    """
+    Start streams for destinations added while a test is running and stop
+    those for removed ones; every other stream keeps going untouched.
+    """
+    now = scheduler.clock()
+    while True:
+        try:
+            change, entry = registry.changes.get_nowait()
+        except queue.Empty:
+            return
+        key = (entry["ip"], entry["port"])
+        running = [s for s in streams.values() if (s.ip, s.port) == key and not s.stopped]
+        if change == "removed":
+            for stream in running:
+                stream.stopped = True
+        elif change == "added" and not running and entry["ip"] != registry.own_ip and end - now > INTERVAL:
+            print(f"[SENDER] Sending to {entry['name']} ({entry['ip']}:{entry['port']}) from now on")
+            for profile in entry.get("profiles", [PROFILES["default"]]):
+                stream = RtpStream(sock, entry, now, duration=end - now, profile=profile)
+                streams[stream.stream_id] = stream
+                scheduler.add(stream, now)
+
+def phase_offset(sender, destination, spread=STAGGER_SPREAD):
+    """
+    Deterministic start offset in [0, spread) for one sender/destination
+    pair. Every beacon computes the same value for the same names, so the
+    mesh spreads its tests across the cycle without coordination.
+    """
+    digest = hashlib.blake2b(f"{sender}->{destination}".encode(), digest_size=8).digest()
+    return spread * int.from_bytes(digest, "big") / 2**64
+
+def start_streams(sock, targets, sender=BEACON_NAME):
+    """
+    Create one stream per target and profile and queue them on a new
+    scheduler starting now. Returns (scheduler, streams by stream id, start).
+    """
+    scheduler = DeadlineScheduler()
+    start = scheduler.clock()
+    staggered = SCHEDULE_MODE == "staggered"
+    streams = {}
+    for t in targets:
+        offset = phase_offset(sender, t["name"]) if staggered else 0.0
+        profiles = t.get("profiles", [PROFILES["default"]])
+        names = [p.get("name", "default") for p in profiles]
+        print(f"[SENDER] Sending to {t['name']} ({t['ip']}:{t['port']})"
+              + (f" at +{offset:.3f} s" if staggered else "")
+              + ("" if names == ["default"] else f", profiles {', '.join(names)}"))
+        # Every profile starts together so the classes see the same network.
+        for profile in profiles:
+            stream = RtpStream(sock, t, start + offset, profile=profile)
+            streams[stream.stream_id] = stream
+            scheduler.add(stream, start + offset)
+    return scheduler, streams, start
+
+def send_streams(sock, targets, registry=None, sender=BEACON_NAME):
+    """
+    Pace one RTP stream per target from a single event loop, collecting
+    reflected probes between sends. With SCHEDULE_MODE=staggered each
+    stream starts at its own phase offset instead of all at once. With a
+    registry, destination changes are applied to the running test as they
+    arrive.
+    """
+    scheduler, streams, start = start_streams(sock, targets, sender)
+
+    def idle(timeout):
+        collect_echoes(sock, streams, timeout)
+        if registry is not None:
+            apply_destination_changes(registry, scheduler, sock, streams, start + DURATION)
+
+    scheduler.run(on_finish=log_stream_report, idle=idle)
+
+    if any(s.echoes for s in streams.values()):
+        deadline = time.monotonic() + ECHO_GRACE
+        while (remaining := deadline - time.monotonic()) > 0:
+            collect_echoes(sock, streams, remaining)
+        for stream in streams.values():
+            log_rtt_report(stream)
+
+def next_cycle_start(now):
+    """First minute-aligned start time (plus the receiver offset) still ahead of now."""
+    start = now.replace(second=0, microsecond=0) + timedelta(seconds=START_DELAY_SECONDS - CYCLE_SECONDS)
+    while start <= now:
+        start += timedelta(seconds=CYCLE_SECONDS)
+    return start
+
+def run_once():
     print("[SENDER] Starting sender.py")
     start_time = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(seconds=START_DELAY_SECONDS)
     print(f"[SENDER] Scheduled start time: {start_time.isoformat()}")
@@ -84,8 +661,9 @@ def main():
     own_ip = get_own_ip()
     print(f"[SENDER] Detected own IP: {own_ip}")
 
-    destinations = fetch_destinations()
-    targets = [d for d in destinations if d["ip"] != own_ip]
+    registry = DestinationRegistry(own_ip=own_ip)
+    registry.load()
+    targets = registry.targets()
 
     if not targets:
         print("[SENDER] No valid destinations after filtering self.")
@@ -94,15 +672,51 @@ def main():
     wait_until(start_time)
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    threads = []
-    for t in targets:
-        thread = threading.Thread(target=send_stream, args=(sock, t))
-        thread.start()
-        threads.append(thread)
-
-    for t in threads:
-        t.join()
+    send_streams(sock, targets)
     sock.close()
 
+def run_service():
+    """
+    Long-running sender: one process, one socket and an in-memory destination
+    list refreshed in the background, with a test started every
+    CYCLE_SECONDS. A cycle that overruns skips to the next aligned start
+    instead of overlapping with it.
+    """
+    print("[SENDER] Starting sender.py in service mode")
+    own_ip = get_own_ip()
+    print(f"[SENDER] Detected own IP: {own_ip}")
+
+    registry = DestinationRegistry(own_ip=own_ip)
+    try:
+        registry.load()
+    except RuntimeError as e:
+        print(f"[SENDER] {e} Retrying every {REFRESH_INTERVAL:g} seconds.")
+    registry.watch()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        while True:
+            start_time = next_cycle_start(datetime.now(timezone.utc))
+            targets = registry.targets()
+            print(f"[SENDER] Next test at {start_time.isoformat()} to {len(targets)} destinations")
+            wait_until(start_time)
+            targets = registry.targets()
+            if targets:
+                send_streams(sock, targets, registry)
+            else:
+                print("[SENDER] No valid destinations after filtering self.")
+    finally:
+        sock.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SpiderMon RTP sender")
+    parser.add_argument("--service", action="store_true", default=SENDER_MODE == "service",
+                        help="run continuously instead of a single cron-launched test")
+    args = parser.parse_args(argv)
+    if args.service:
+        run_service()
+    else:
+        run_once()
+
 if __name__ == "__main__":
     main()
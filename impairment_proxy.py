@@ -0,0 +1,315 @@
+"""
+Userspace UDP impairment proxy for checking the receiver against ground truth.
+
+Sits between a sender and a receiver on localhost and applies random or
+Gilbert-Elliott burst loss, fixed delay, jitter, reordering and
+duplication. Every forwarded packet is recorded, so the loss, jitter,
+duplicates and reordering the receiver should report are known exactly.
+
+Forward with the given impairments until interrupted:
+
+    python3 impairment_proxy.py --listen 5006 --upstream 127.0.0.1:5004 --loss 2 --jitter 5
+
+Run the built-in scenarios through sender, proxy and receiver, and fail
+if any reported metric falls outside its tolerance:
+
+    python3 impairment_proxy.py --scenarios [--duration 10]
+"""
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import queue
+import random
+import select
+import socket
+import sys
+import time
+
+import receiver
+import sender
+from bench_mesh import receiver_main
+
+class GilbertElliott:
+    """
+    Two-state burst loss: p is the chance of moving from good to bad per
+    packet, r of moving back, and loss_good / loss_bad the loss probability
+    in each state. Mean burst length is 1 / r.
+    """
+
+    def __init__(self, p, r, loss_good=0.0, loss_bad=1.0, rng=random):
+        self.p = p
+        self.r = r
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        self.rng = rng
+        self.bad = False
+
+    def drop(self):
+        if self.bad:
+            self.bad = self.rng.random() >= self.r
+        else:
+            self.bad = self.rng.random() < self.p
+        return self.rng.random() < (self.loss_bad if self.bad else self.loss_good)
+
+class Impairment:
+    """
+    Decides the fate of each packet: fate(now) returns the times at which
+    copies of it leave the proxy, an empty list meaning it is lost.
+    Percentages are per packet; delays are in milliseconds.
+    """
+
+    def __init__(self, loss=0.0, burst=None, delay=0.0, jitter=0.0, reorder=0.0, reorder_delay=None,
+                 duplicate=0.0, seed=1):
+        self.rng = random.Random(seed)
+        self.loss = loss / 100
+        self.burst = GilbertElliott(*burst, rng=self.rng) if burst else None
+        self.delay = delay / 1000
+        self.jitter = jitter / 1000
+        self.reorder = reorder / 100
+        self.reorder_delay = 3 * sender.INTERVAL if reorder_delay is None else reorder_delay / 1000
+        self.duplicate = duplicate / 100
+
+    def fate(self, now):
+        rng = self.rng
+        if self.burst is not None and self.burst.drop():
+            return []
+        if rng.random() < self.loss:
+            return []
+        release = now + self.delay
+        if self.jitter:
+            release += abs(rng.gauss(0, self.jitter))
+        if rng.random() < self.reorder:
+            release += self.reorder_delay
+        if rng.random() < self.duplicate:
+            return [release, release + sender.INTERVAL / 2]
+        return [release]
+
+class ImpairmentProxy:
+    """
+    Forwards datagrams from listen to upstream through an Impairment.
+
+    Packets waiting out their delay sit in a heap keyed on release time;
+    the loop sleeps in select() until the next release or the next packet,
+    and drains every datagram that is ready, so it keeps up with high
+    packet rates on a single thread.
+    """
+
+    def __init__(self, listen, upstream, impairment):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        self.sock.bind(listen)
+        self.sock.setblocking(False)
+        self.upstream = upstream
+        self.impairment = impairment
+        self.heap = []
+        self.order = itertools.count()
+        self.arrivals = 0
+        # Ground truth: (arrival index, seq, rtp ts, time sent if probed, time forwarded) per copy.
+        self.forwarded = []
+
+    def run(self, stop=None):
+        """Forward until stop is set and every held packet has left."""
+        heap = self.heap
+        while True:
+            now = time.monotonic()
+            while heap and heap[0][0] <= now:
+                _, _, index, data = heapq.heappop(heap)
+                self.sock.sendto(data, self.upstream)
+                _, seq, ts, _ = receiver.RTP_HEADER.unpack_from(data)
+                sent = None
+                if len(data) >= receiver.PROBE_END:
+                    magic, _, sent_ns = receiver.PROBE.unpack_from(data, receiver.RTP_HEADER.size)
+                    if magic == receiver.PROBE_MAGIC:
+                        sent = sent_ns * 1e-9
+                self.forwarded.append((index, seq, ts, sent, time.time()))
+            if stop is not None and stop.is_set() and not heap:
+                return
+            timeout = heap[0][0] - time.monotonic() if heap else 0.05
+            if not select.select([self.sock], [], [], max(timeout, 0))[0]:
+                continue
+            while True:
+                try:
+                    data, addr = self.sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                if addr == self.upstream or len(data) < receiver.RTP_HEADER.size:
+                    continue
+                now = time.monotonic()
+                for release in self.impairment.fate(now):
+                    heapq.heappush(heap, (release, next(self.order), self.arrivals, data))
+                self.arrivals += 1
+
+    def truth(self):
+        """What a receiver of the forwarded packets should report."""
+        first = {}
+        duplicates = reordered = 0
+        highest = -1
+        jitter = receiver.JitterEstimator()
+        transit, delays = [], []
+        for index, seq, ts, sent, forwarded in self.forwarded:
+            jitter.update(forwarded, ts)
+            transit.append(forwarded - ts / receiver.RATE)
+            if sent is not None:
+                delays.append(1000 * (forwarded - sent))
+            if index in first:
+                duplicates += 1
+                continue
+            first[index] = forwarded
+            if index < highest:
+                reordered += 1
+            highest = max(highest, index)
+        if not first:
+            return {'expected': 0, 'lost': 0, 'loss_pct': 0.0, 'duplicates': 0, 'reordered': 0,
+                    'jitter_ms': 0.0, 'mos': receiver.calculate_mos(0.0).item()}
+        # Only losses between the first and last delivered packet are visible.
+        expected = max(first) - min(first) + 1
+        lost = expected - len(first)
+        loss_pct = 100.0 * lost / expected
+        delivered = sorted(first)
+        runs = [b - a - 1 for a, b in zip(delivered, delivered[1:]) if b - a > 1]
+        # The receiver's playout buffer model: copies more than
+        # JITTER_BUFFER_MS behind the fastest one miss their slot.
+        fastest = min(transit)
+        late = sum(1000 * (t - fastest) > receiver.JITTER_BUFFER_MS for t in transit)
+        effective = 100.0 * min(lost + late, expected) / expected
+        if receiver.MOS_DELAY == 'one-way':
+            delay = sum(delays) / len(delays) if delays else 0.0
+        else:
+            delay = 0.0 if receiver.MOS_DELAY == 'none' else receiver.MOS_DELAY
+        delay += receiver.JITTER_BUFFER_MS + 1000 * sender.INTERVAL + receiver.CODECS[receiver.CODEC]['lookahead_ms']
+        burst = receiver.burst_ratio(lost, expected, len(runs), sum(runs))
+        return {
+            'expected': expected,
+            'lost': lost,
+            'loss_pct': loss_pct,
+            'duplicates': duplicates,
+            'reordered': reordered,
+            'jitter_ms': jitter.jitter_ms(),
+            'mos': receiver.calculate_mos(effective, delay, burst).item(),
+        }
+
+# Scripted scenarios: name -> Impairment arguments
+SCENARIOS = {
+    'clean':          {},
+    'random_loss':    {'loss': 2.0},
+    'burst_loss':     {'burst': (0.01, 0.3)},
+    'delay_jitter':   {'delay': 40.0, 'jitter': 5.0},
+    'reorder':        {'reorder': 3.0},
+    'duplicate':      {'duplicate': 2.0},
+    'combined':       {'loss': 1.0, 'burst': (0.005, 0.4), 'delay': 20.0, 'jitter': 3.0, 'reorder': 1.0, 'duplicate': 1.0},
+}
+
+# Allowed |reported - truth| per metric: (absolute, relative to truth)
+TOLERANCES = {
+    'loss_pct':   (0.25, 0.0),
+    'jitter_ms':  (0.5, 0.1),
+    'mos':        (0.1, 0.0),
+    'duplicates': (1, 0.0),
+    'reordered':  (1, 0.1),
+}
+
+def proxy_main(listen, upstream, impairment, stop, channel):
+    proxy = ImpairmentProxy(listen, upstream, impairment)
+    channel.put(('ready', proxy.sock.getsockname()))
+    proxy.run(stop)
+    channel.put(('truth', proxy.truth()))
+
+def run_scenario(name, duration, seed):
+    """Stream through the proxy into a receiver; return (truth, reported)."""
+    impairment = Impairment(seed=seed, **SCENARIOS[name])
+    rx_channel, proxy_channel = multiprocessing.Queue(), multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    rx = multiprocessing.Process(target=receiver_main, args=(rx_channel,), daemon=True)
+    rx.start()
+    try:
+        _, rx_port, _ = rx_channel.get(timeout=10)
+        proxy = multiprocessing.Process(target=proxy_main, daemon=True,
+                                        args=(('127.0.0.1', 0), ('127.0.0.1', rx_port), impairment, stop, proxy_channel))
+        proxy.start()
+        _, (_, proxy_port) = proxy_channel.get(timeout=10)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        scheduler = sender.DeadlineScheduler()
+        target = {'name': name, 'ip': '127.0.0.1', 'port': proxy_port}
+        scheduler.add(sender.RtpStream(sock, target, scheduler.clock(), duration=duration), scheduler.clock())
+        scheduler.run()
+        sock.close()
+        stop.set()
+        _, truth = proxy_channel.get(timeout=10)
+        proxy.join(timeout=5)
+
+        reported = {}
+        deadline = time.monotonic() + receiver.STREAM_TIMEOUT + 5
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                _, results, _ = rx_channel.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if results:
+                reported = results[0]
+                break
+    finally:
+        rx.terminate()
+    return truth, reported
+
+def check(truth, reported):
+    """Return {metric: (truth, reported, ok)} under TOLERANCES."""
+    checks = {}
+    for key, (absolute, relative) in TOLERANCES.items():
+        value = reported.get(key)
+        if value is None:
+            checks[key] = (truth[key], None, False)
+            continue
+        checks[key] = (truth[key], value, abs(value - truth[key]) <= absolute + relative * abs(truth[key]))
+    return checks
+
+def run_scenarios(names, duration, seed):
+    failed = 0
+    for name in names:
+        truth, reported = run_scenario(name, duration, seed)
+        checks = check(truth, reported)
+        ok = all(c[2] for c in checks.values())
+        failed += not ok
+        print(f"[PROXY] {name:<14} {'PASS' if ok else 'FAIL'}")
+        for key, (want, got, good) in checks.items():
+            got = 'missing' if got is None else f"{got:.3f}"
+            print(f"[PROXY]     {key:<11} truth {want:9.3f}  reported {got:>9}  {'' if good else '<-- out of tolerance'}")
+    return failed
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SpiderMon UDP impairment proxy")
+    parser.add_argument("--listen", type=int, default=5006, help="local UDP port to accept packets on")
+    parser.add_argument("--upstream", type=parse_address, default=('127.0.0.1', receiver.PORT), help="host:port to forward to")
+    parser.add_argument("--loss", type=float, default=0.0, help="random loss (%%)")
+    parser.add_argument("--burst", type=lambda s: tuple(float(v) for v in s.split(',')),
+                        help="Gilbert-Elliott burst loss as p,r[,loss_good,loss_bad]")
+    parser.add_argument("--delay", type=float, default=0.0, help="fixed delay (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="delay variation, Gaussian sigma (ms)")
+    parser.add_argument("--reorder", type=float, default=0.0, help="packets held back past their successors (%%)")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="packets sent twice (%%)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scenarios", nargs='*', metavar='NAME',
+                        help=f"run scripted scenarios and check the receiver (default all: {', '.join(SCENARIOS)})")
+    parser.add_argument("--duration", type=float, default=10, help="seconds each scenario streams for")
+    args = parser.parse_args(argv)
+
+    if args.scenarios is not None:
+        sys.exit(1 if run_scenarios(args.scenarios or list(SCENARIOS), args.duration, args.seed) else 0)
+
+    impairment = Impairment(args.loss, args.burst, args.delay, args.jitter, args.reorder, duplicate=args.duplicate, seed=args.seed)
+    proxy = ImpairmentProxy(('', args.listen), args.upstream, impairment)
+    print(f"[PROXY] Forwarding UDP {args.listen} to {args.upstream[0]}:{args.upstream[1]}")
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        truth = proxy.truth()
+        print(f"[PROXY] Forwarded {len(proxy.forwarded)} packets - Loss: {truth['loss_pct']:.2f}%, "
+              f"Jitter: {truth['jitter_ms']:.2f} ms, Dup: {truth['duplicates']}, Reordered: {truth['reordered']}")
+
+if __name__ == "__main__":
+    main()
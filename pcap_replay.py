@@ -0,0 +1,249 @@
+"""
+Offline replay of a pcap or pcapng capture through the receiver's analysis.
+
+UDP datagrams in the capture are fed to the same PacketStore, window
+closing and per-source loss/jitter/MOS code as the live receiver, with the
+capture timestamps as arrival times, so a tcpdump taken at a complaining
+site yields the windows the receiver would have published there.
+
+The file is mapped with mmap and parsed through memoryview slices, so
+multi-GB captures are streamed without being read into memory.
+
+    python3 pcap_replay.py capture.pcap [--port 5004] [--json windows.jsonl]
+"""
+import argparse
+import json
+import mmap
+import socket
+import struct
+import sys
+import time
+
+import receiver
+
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 14, 101)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPPROTO_UDP = 17
+# Ethernet + IPv4 header fields read in one go on the common path:
+# ethertype, version/IHL, flags/fragment offset, protocol, source address.
+ETHER_IPV4 = struct.Struct('!12xHB5xHxB2x4s')
+UDP_HEADER = struct.Struct('!HHH')
+
+def pcap_frames(view):
+    """Yield (timestamp, linktype, frame) from a classic pcap file."""
+    order, unit = PCAP_MAGIC[bytes(view[:4])]
+    linktype = struct.unpack_from(order + 'I', view, 20)[0] & 0x0FFFFFFF
+    record = struct.Struct(order + 'IIII')
+    offset, end = 24, len(view)
+    while offset + record.size <= end:
+        sec, frac, caplen, _ = record.unpack_from(view, offset)
+        offset += record.size
+        yield sec + frac * unit, linktype, view[offset:offset + caplen]
+        offset += caplen
+
+def pcapng_frames(view):
+    """
+    Yield (timestamp, linktype, frame) from a pcapng file, following each
+    section's byte order and each interface's link type and timestamp
+    resolution. Simple packet blocks carry no timestamp and are skipped.
+    """
+    offset, end = 0, len(view)
+    order, interfaces = '<', []
+    while offset + 12 <= end:
+        block_type = struct.unpack_from('<I', view, offset)[0]
+        if block_type == PCAPNG_SHB:
+            magic = struct.unpack_from('<I', view, offset + 8)[0]
+            order = '<' if magic == PCAPNG_BYTE_ORDER else '>'
+            interfaces = []
+        block_type, length = struct.unpack_from(order + 'II', view, offset)
+        if length < 12:
+            raise ValueError(f"Corrupt pcapng block at offset {offset}")
+        if block_type == 1:
+            interfaces.append(_pcapng_interface(view, offset, length, order))
+        elif block_type == 6:
+            iface, high, low, caplen = struct.unpack_from(order + 'IIII', view, offset + 8)
+            linktype, unit = interfaces[iface]
+            start = offset + 28
+            yield ((high << 32) | low) * unit, linktype, view[start:start + caplen]
+        offset += length
+
+def _pcapng_interface(view, offset, length, order):
+    """(linktype, seconds per timestamp unit) from an interface description block."""
+    linktype = struct.unpack_from(order + 'H', view, offset + 8)[0]
+    unit = 1e-6
+    pos, end = offset + 16, offset + length - 4
+    while pos + 4 <= end:
+        code, size = struct.unpack_from(order + 'HH', view, pos)
+        if code == 0:
+            break
+        if code == 9 and size >= 1:
+            resolution = view[pos + 4]
+            unit = 2.0 ** -(resolution & 0x7F) if resolution & 0x80 else 10.0 ** -resolution
+        pos += 4 + ((size + 3) & ~3)
+    return linktype, unit
+
+def capture_frames(view):
+    """Yield (timestamp, linktype, frame) from a pcap or pcapng capture."""
+    if bytes(view[:4]) in PCAP_MAGIC:
+        return pcap_frames(view)
+    if struct.unpack_from('<I', view)[0] == PCAPNG_SHB:
+        return pcapng_frames(view)
+    raise ValueError("Not a pcap or pcapng capture")
+
+def network_layer(linktype, frame):
+    """Return (ethertype, offset of the IP header) for a link-layer frame, or None."""
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype, offset = struct.unpack_from('!H', frame, 12)[0], 14
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype, offset = struct.unpack_from('!H', frame, offset + 2)[0], offset + 4
+        return ethertype, offset
+    if linktype == LINKTYPE_LINUX_SLL:
+        return struct.unpack_from('!H', frame, 14)[0], 16
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return struct.unpack_from('!H', frame, 0)[0], 20
+    if linktype in LINKTYPE_RAW:
+        return (ETHERTYPE_IPV4 if frame[0] >> 4 == 4 else ETHERTYPE_IPV6), 0
+    if linktype == LINKTYPE_IPV4:
+        return ETHERTYPE_IPV4, 0
+    if linktype == LINKTYPE_IPV6:
+        return ETHERTYPE_IPV6, 0
+    if linktype == LINKTYPE_NULL:
+        return (ETHERTYPE_IPV4 if frame[4] >> 4 == 4 else ETHERTYPE_IPV6), 4
+    return None
+
+def udp_datagrams(frames, port=None):
+    """
+    Yield (timestamp, (source ip, source port), payload) for every UDP
+    datagram in frames, optionally only those sent to port. Non-first IPv4
+    fragments and IPv6 extension headers are skipped.
+    """
+    names = {}
+    for ts, linktype, frame in frames:
+        try:
+            if linktype == LINKTYPE_ETHERNET:
+                ethertype, vihl, fragment, proto, src = ETHER_IPV4.unpack_from(frame)
+                if ethertype == ETHERTYPE_IPV4:
+                    if proto != IPPROTO_UDP or fragment & 0x1FFF:
+                        continue
+                    udp = 14 + (vihl & 0x0F) * 4
+                    sport, dport, length = UDP_HEADER.unpack_from(frame, udp)
+                    if port is not None and dport != port:
+                        continue
+                    name = names.get(src)
+                    if name is None:
+                        name = names[src] = socket.inet_ntop(socket.AF_INET, src)
+                    yield ts, (name, sport), frame[udp + 8:udp + max(length, 8)]
+                    continue
+            layer = network_layer(linktype, frame)
+            if layer is None:
+                continue
+            ethertype, ip = layer
+            if ethertype == ETHERTYPE_IPV4:
+                ihl = (frame[ip] & 0x0F) * 4
+                if frame[ip + 9] != IPPROTO_UDP or struct.unpack_from('!H', frame, ip + 6)[0] & 0x1FFF:
+                    continue
+                src, family, udp = bytes(frame[ip + 12:ip + 16]), socket.AF_INET, ip + ihl
+            elif ethertype == ETHERTYPE_IPV6:
+                if frame[ip + 6] != IPPROTO_UDP:
+                    continue
+                src, family, udp = bytes(frame[ip + 8:ip + 24]), socket.AF_INET6, ip + 40
+            else:
+                continue
+            sport, dport, length = UDP_HEADER.unpack_from(frame, udp)
+        except (IndexError, struct.error):
+            continue
+        if port is not None and dport != port:
+            continue
+        name = names.get(src)
+        if name is None:
+            name = names[src] = socket.inet_ntop(family, src)
+        yield ts, (name, sport), frame[udp + 8:udp + max(length, 8)]
+
+def replay(path, on_window, port=None):
+    """
+    Run the capture at path through the receiver's windows, calling
+    on_window(stamp, results) as each window closes on capture time.
+    Returns the number of datagrams analysed.
+    """
+    store = receiver.PacketStore()
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        packets, window_end, last = _ingest_capture(memoryview(mm), store, on_window, port)
+        # Only closed once every slice is gone; after an error the map is
+        # left to the garbage collector rather than hiding the error.
+        mm.close()
+    if window_end is not None:
+        # The capture ends mid-window: flush what is left as the live
+        # receiver would at the window's end (or each source's last packet).
+        if receiver.RECEIVER_WINDOWS == 'per-source':
+            stamp, results = last, receiver.close_window(store)
+        else:
+            stamp, results = window_end, receiver.close_window(store, window_end)
+        if results:
+            on_window(stamp, results)
+    return packets
+
+def _ingest_capture(view, store, on_window, port):
+    packets, window_end, ts = 0, None, None
+    for ts, addr, payload in udp_datagrams(capture_frames(view), port):
+        if window_end is None:
+            window_end = receiver.first_window_check(ts)
+        while ts >= window_end:
+            stamp, results, window_end = receiver.close_due(store, ts, window_end)
+            if results is not None:
+                on_window(stamp, results)
+        receiver.ingest_packet(store, payload, addr, ts)
+        packets += 1
+    view.release()
+    return packets, window_end, ts
+
+def json_results(stamp, results):
+    """One JSON-serialisable record per window, sketches left out."""
+    return {
+        'window_end': stamp,
+        'results': [{k: v for k, v in r.items() if not k.endswith('_sketch') and k != 'history'} for r in results],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a pcap/pcapng capture through the SpiderMon receiver analysis")
+    parser.add_argument("capture", help="pcap or pcapng file, e.g. from tcpdump -w")
+    parser.add_argument("--port", type=int, default=receiver.PORT, help="UDP destination port to analyse (0 for all)")
+    parser.add_argument("--json", help="also write each window's results as a JSON line to this file")
+    args = parser.parse_args(argv)
+
+    out = open(args.json, 'w') if args.json else None
+
+    def on_window(stamp, results):
+        receiver.publish_window(stamp, results)
+        if out is not None:
+            out.write(json.dumps(json_results(stamp, results)) + '\n')
+
+    started = time.perf_counter()
+    try:
+        packets = replay(args.capture, on_window, args.port or None)
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print(f"[RECEIVER] Replayed {packets} packets from {args.capture} in {elapsed:.2f} s "
+          f"({packets / elapsed if elapsed else 0:,.0f} packets/s)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+import receiver
+import sender
+
+
+def feed(store, factory, addr, seq, now):
+    receiver.ingest_packet(store, factory.build(seq, seq * 160), addr, now)
+
+
+def test_per_source_windows_keep_nat_streams_apart(monkeypatch):
+    monkeypatch.setattr(receiver, 'RECEIVER_WINDOWS', 'per-source')
+    store = receiver.PacketStore()
+    names = receiver.SourceNames('')
+    collector = receiver.ResultsCollector(ttl=600)
+    a = sender.PacketFactory(stream_id=1, ssrc=1)
+    b = sender.PacketFactory(stream_id=2, ssrc=2)
+    first, second = ('203.0.113.5', 40000), ('203.0.113.5', 40001)
+    t0 = 1_000_000.0
+    labels = set()
+    check = t0
+    for i in range(150 * 50):
+        now = t0 + i * 0.02
+        feed(store, a, first, i, now)
+        if now >= t0 + 30:
+            feed(store, b, second, i, now + 0.001)
+        if now >= check:
+            stamp, results, check = receiver.close_due(store, now, check)
+            if results:
+                # Staggered starts: the two streams' windows close apart.
+                assert len(results) == 1
+                names.label(results)
+                collector.update(stamp, results)
+                labels.update(r['source'] for r in results)
+    assert labels == {'203.0.113.5:40000', '203.0.113.5:40001'}
+    assert len(collector.series) == 2
+
+
+def test_restart_on_a_new_port_keeps_the_plain_name(monkeypatch):
+    monkeypatch.setattr(receiver, 'RECEIVER_WINDOWS', 'per-source')
+    store = receiver.PacketStore()
+    names = receiver.SourceNames('')
+    t0 = 1_000_000.0
+    labels = []
+    for port, start in ((40000, t0), (40002, t0 + 100)):
+        factory = sender.PacketFactory(ssrc=port)
+        for i in range(500):
+            feed(store, factory, ('203.0.113.5', port), i, start + i * 0.02)
+        results = receiver.close_window(store, None)
+        names.label(results)
+        labels += [r['source'] for r in results]
+    assert labels == ['203.0.113.5', '203.0.113.5']
+
+
+def summary_result(source, bins):
+    counts = np.zeros(receiver.SKETCH_BINS, dtype=np.int64)
+    counts[:bins] = 1
+    return {'source': source, 'profile': 'default', 'received': 100, 'lost': 1, 'loss_pct': 1.0, 'jitter_ms': 0.5,
+            'delay_ms': float('nan'), 'delay_p99_ms': float('nan'), 'mos': 4.3,
+            'jitter_sketch': receiver.QuantileSketch(counts, float(bins))}
+
+
+def test_summaries_fit_the_mtu_and_keep_the_sketch_total():
+    messages = receiver.encode_summaries('dest', 1000.0, [summary_result('a', 897), summary_result('b', 10)])
+    assert all(len(m) <= receiver.SUMMARY_MTU for m in messages)
+    decoded = receiver.decode_summaries(b''.join(messages))
+    assert [r['source'] for _, _, r in decoded] == ['a', 'b']
+    assert decoded[0][2]['jitter_sketch'].counts.sum() == 897
+
+
+def test_summary_names_are_cut_on_a_character_boundary():
+    name = 'é' * 200
+    (message,) = receiver.encode_summaries(name, 1000.0, [summary_result(name, 3)])
+    ((destination, _, record),) = receiver.decode_summaries(message)
+    assert destination == record['source'] == 'é' * 127
+
+
+def test_truncated_summary_is_rejected_whole():
+    message = b''.join(receiver.encode_summaries('dest', 1000.0, [summary_result('a', 3), summary_result('b', 3)]))
+    for cut in range(1, len(message)):
+        with pytest.raises(ValueError):
+            receiver.decode_summaries(message[:cut])
+
+
+def scored(delay_ms):
+    result = {'expected': 100, 'lost': 0, 'late_discards': 0, 'delay_ms': delay_ms, 'packet_interval_ms': 20.0,
+              'burst_ratio': 1.0}
+    receiver.score_window([result])
+    return result['mos']
+
+
+def test_mos_ignores_clock_skew_unless_asked(monkeypatch):
+    perfect = scored(float('nan'))
+    assert scored(3000.0) == perfect > 4.3
+    monkeypatch.setattr(receiver, 'MOS_DELAY', 'one-way')
+    assert scored(3000.0) < 2
+    monkeypatch.setattr(receiver, 'MOS_DELAY', 250.0)
+    assert scored(3000.0) == scored(0.0) < perfect
+
+
+def run_sequence(seqs, tracker=None):
+    tracker = tracker or receiver.SequenceTracker()
+    for seq in seqs:
+        tracker.update(seq)
+    return tracker
+
+
+def test_reordered_start_counts_the_early_packet_as_received():
+    counts = run_sequence([5, 4, 6, 7] + list(range(8, 400))).snapshot()
+    assert (counts['expected'], counts['lost'], counts['duplicates'], counts['reordered']) == (396, 0, 0, 1)
+    counts = run_sequence([5, 3, 6]).snapshot()
+    assert (counts['expected'], counts['lost'], counts['reordered']) == (4, 1, 1)
+
+
+def test_stray_and_restart_never_report_negative_reordering():
+    stray = run_sequence(list(range(1, 11)) + [40000])
+    assert stray.snapshot()['reordered'] == 0
+    assert run_sequence([11], stray).snapshot()['reordered'] == 1
+
+    restart = run_sequence(list(range(1, 11)) + [40000])
+    assert restart.snapshot()['reordered'] == 0
+    counts = run_sequence([40001, 40002], restart).snapshot()
+    assert (counts['reordered'], counts['sequence_resets']) == (0, 1)
+
+
+def test_per_source_releases_a_stream_that_ends_right_after_a_full_window(monkeypatch):
+    monkeypatch.setattr(receiver, 'RECEIVER_WINDOWS', 'per-source')
+    store = receiver.PacketStore()
+    factory = sender.PacketFactory(ssrc=7)
+    t0 = 1_000_000.0
+    end = t0 + receiver.WINDOW_SECONDS
+    for i in range(int(receiver.WINDOW_SECONDS / 0.02) + 1):
+        feed(store, factory, ('198.51.100.7', 5004), i, t0 + i * 0.02)
+    _, results, _ = receiver.close_due(store, end + 0.01, end)
+    assert results and store.rows
+    receiver.close_due(store, end + receiver.STREAM_TIMEOUT + 1, end)
+    assert not store.rows and not store.streams and not store.peers
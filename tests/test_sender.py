@@ -0,0 +1,42 @@
+import json
+
+import sender
+
+
+def test_non_finite_and_oversized_numbers_reject_only_their_entry(tmp_path):
+    good = {"name": "ok", "ip": "192.0.2.1", "port": 5004}
+    data = json.loads('[{"name": "inf", "ip": "192.0.2.2", "profiles": [{"name": "x", "interval": Infinity}]},'
+                      ' {"name": "nan", "ip": "192.0.2.3", "profiles": [{"name": "x", "interval": NaN}]},'
+                      ' {"name": "big", "ip": "192.0.2.4", "port": 1e400},'
+                      ' {"name": "size", "ip": "192.0.2.5", "profiles": [{"name": "x", "payload_size": -1e400}]}]')
+    path = tmp_path / "destinations.json"
+    path.write_text(json.dumps([good] + data))
+    registry = sender.DestinationRegistry(source=str(path), cache_file=str(tmp_path / "cache.json"))
+    registry.load()
+    assert [e["name"] for e in registry.entries.values()] == ["ok"]
+
+
+def test_profile_interval_must_be_whole_ticks():
+    assert sender.validate_profile({"name": "x", "interval": 0.0125}) is not None
+    assert sender.validate_profile({"name": "x", "interval": 0.0333}) is None
+
+
+class FlakySocket:
+    """Fails every third send with EAGAIN."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def sendto(self, data, addr):
+        self.calls += 1
+        if self.calls % 3 == 0:
+            raise BlockingIOError(11, "Resource temporarily unavailable")
+
+
+def test_failed_sends_are_not_counted_as_sent():
+    stream = sender.RtpStream(FlakySocket(), {"ip": "192.0.2.1", "port": 5004}, start=0.0, duration=1.0, interval=0.02)
+    deadline = stream.start
+    while deadline is not None:
+        deadline = stream.fire(deadline, lambda: deadline)
+    report = stream.report()
+    assert (report["sent"], report["send_errors"]) == (34, 16)